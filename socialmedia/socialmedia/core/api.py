@@ -0,0 +1,178 @@
+# core/api.py
+#
+# Versioned JSON feed API (v1) for mobile clients and export jobs.
+# Responses are streamed: rows are read from a server-side cursor with
+# .iterator(chunk_size=...) as plain dicts (no model instances) and written
+# out a chunk at a time, so a worker never holds a whole range in memory.
+# Under ASGI the stream is an async generator that reads each chunk through
+# sync_to_async (Django would buffer a sync iterator whole there); under
+# WSGI it is a plain generator, since WSGI buffers an async one instead.
+#
+# The paginated load-more endpoints in views.py serialize their posts with
+# export_object(), so both paths emit the same post objects.
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields.files import FieldFile
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+
+from .models import Group, GroupPost, Post, User
+from .memberships import is_group_member
+from .pagination import InvalidCursor, after_cursor, encode_keyset
+from .timeline import get_timeline
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_STREAM_CHUNK_SIZE = getattr(settings, 'API_STREAM_CHUNK_SIZE', 500)
+API_STREAM_MAX_ROWS = getattr(settings, 'API_STREAM_MAX_ROWS', 10000)
+
+POST_FIELDS = (
+    'id', 'user_id', 'user__username', 'content', 'media_type', 'media_file',
+    'image', 'video', 'created_at', 'like_count', 'comment_count',
+)
+GROUP_POST_FIELDS = (
+    'id', 'group_id', 'user_id', 'user__username', 'content', 'media_type',
+    'media_file', 'created_at', 'like_count',
+)
+MEDIA_FIELDS = ('media_file', 'image', 'video')
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def export_row(row):
+    row['username'] = row.pop('user__username')
+    row['created_at'] = row['created_at'].isoformat()
+    for field in MEDIA_FIELDS:
+        if field in row:
+            row[field] = default_storage.url(row[field]) if row[field] else None
+    return row
+
+
+def export_object(obj, fields):
+    """Serialize a model instance as export_row() does its values() row."""
+    row = {}
+    for field in fields:
+        value = obj
+        for name in field.split('__'):
+            value = getattr(value, name)
+        row[field] = value.name if isinstance(value, FieldFile) else value
+    return export_row(row)
+
+
+def read_chunk(rows):
+    """Serialize the next chunk of ``rows``; return it with the (created_at,
+    id) keyset of its last row."""
+    chunk = []
+    last = None
+    for row in islice(rows, API_STREAM_CHUNK_SIZE):
+        last = (row['created_at'], row['id'])
+        chunk.append(dumps(export_row(row)))
+    return chunk, last
+
+
+FEED_HEAD = b'{"status":"success","posts":['
+
+
+def feed_tail(last, count, limit):
+    # A full range means there may be more rows after the last one sent
+    next_cursor = encode_keyset(*last) if last and count == limit else None
+    return b'],"next_cursor":' + dumps(next_cursor) + b'}'
+
+
+def stream_feed(rows, limit):
+    yield FEED_HEAD
+    count = 0
+    last = None
+    try:
+        while True:
+            chunk, chunk_last = read_chunk(rows)
+            if not chunk:
+                break
+            yield (b',' if count else b'') + b','.join(chunk)
+            count += len(chunk)
+            last = chunk_last
+    finally:
+        rows.close()
+    yield feed_tail(last, count, limit)
+
+
+async def astream_feed(rows, limit):
+    yield FEED_HEAD
+    count = 0
+    last = None
+    try:
+        # The iterator holds a server-side cursor, so it is always read
+        # (and closed) through the same thread-sensitive executor
+        while True:
+            chunk, chunk_last = await sync_to_async(read_chunk)(rows)
+            if not chunk:
+                break
+            yield (b',' if count else b'') + b','.join(chunk)
+            count += len(chunk)
+            last = chunk_last
+    finally:
+        await sync_to_async(rows.close)()
+    yield feed_tail(last, count, limit)
+
+
+def feed_response(request, queryset, fields):
+    try:
+        limit = int(request.GET.get('limit', API_STREAM_MAX_ROWS))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid limit'}, status=400)
+    limit = max(1, min(limit, API_STREAM_MAX_ROWS))
+
+    since = request.GET.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'status': 'error', 'message': 'Invalid since'}, status=400)
+        queryset = queryset.filter(created_at__gte=since)
+
+    try:
+        queryset = after_cursor(queryset, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    rows = queryset.values(*fields)[:limit].iterator(chunk_size=API_STREAM_CHUNK_SIZE)
+    stream = astream_feed if isinstance(request, ASGIRequest) else stream_feed
+    return StreamingHttpResponse(stream(rows, limit), content_type='application/json')
+
+
+@require_GET
+@login_required
+def home_feed(request):
+    queryset = Post.objects.filter(id__in=get_timeline(request.user))
+    return feed_response(request, queryset, POST_FIELDS)
+
+
+@require_GET
+@login_required
+def profile_feed(request, username):
+    user = get_object_or_404(User, username=username)
+    return feed_response(request, Post.objects.filter(user=user), POST_FIELDS)
+
+
+@require_GET
+@login_required
+def group_feed(request, group_id):
+    group = get_object_or_404(Group, id=group_id)
+    if group.privacy == 'private' and not is_group_member(group.id, request.user.id):
+        return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
+    return feed_response(request, GroupPost.objects.filter(group=group), GROUP_POST_FIELDS)
@@ -0,0 +1,199 @@
+# core/backpressure.py
+#
+# Flow control for the websocket consumers, so one noisy or slow socket
+# cannot degrade a whole worker.
+#
+# Inbound: every connection has a token bucket (CHAT_RATE / CALL_SIGNAL_RATE
+# frames per second, bursts up to the matching *_BURST) and every group and
+# call has one shared by all of its sockets in this worker. A frame over
+# either limit is dropped, with one error frame per run of drops; a socket
+# that keeps pushing past its limit is closed. Frames over
+# WS_MAX_FRAME_BYTES are dropped before they are parsed.
+#
+# Outbound: frames go through a bounded OutboundQueue drained by one writer
+# task, so a client that reads slowly fills its own queue instead of
+# stalling the consumer, and with it the channel-layer receives for that
+# socket. Frames with a coalesce key (presence, errors) replace any queued
+# frame with the same key; when the queue is full the oldest frame is
+# dropped. Chat frames carry sequence numbers, so a client that lost some
+# can resubscribe from its last seq and have the gap replayed.
+#
+# Everything shed is counted in ``shed_load`` and logged at most once per
+# WS_METRICS_LOG_INTERVAL seconds. Buckets and counters are per process and
+# only touched from the event loop.
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHAT_RATE = getattr(settings, 'CHAT_RATE', 5)
+CHAT_BURST = getattr(settings, 'CHAT_BURST', 10)
+CHAT_GROUP_RATE = getattr(settings, 'CHAT_GROUP_RATE', 50)
+CHAT_GROUP_BURST = getattr(settings, 'CHAT_GROUP_BURST', 100)
+CALL_SIGNAL_RATE = getattr(settings, 'CALL_SIGNAL_RATE', 30)
+CALL_SIGNAL_BURST = getattr(settings, 'CALL_SIGNAL_BURST', 60)
+CALL_GROUP_RATE = getattr(settings, 'CALL_GROUP_RATE', 200)
+CALL_GROUP_BURST = getattr(settings, 'CALL_GROUP_BURST', 400)
+WS_MAX_FRAME_BYTES = getattr(settings, 'WS_MAX_FRAME_BYTES', 16 * 1024)
+WS_SEND_QUEUE_SIZE = getattr(settings, 'WS_SEND_QUEUE_SIZE', 256)
+# Consecutive rate-limited frames after which the socket is closed
+WS_MAX_VIOLATIONS = getattr(settings, 'WS_MAX_VIOLATIONS', 50)
+WS_METRICS_LOG_INTERVAL = getattr(settings, 'WS_METRICS_LOG_INTERVAL', 60)
+
+# Close code for sockets closed for flooding (4000-4999 are application codes)
+CLOSE_RATE_LIMITED = 4429
+
+shed_load = Counter()
+_last_logged = [time.monotonic(), Counter()]
+
+
+def count_shed(reason, n=1):
+    shed_load[reason] += n
+    now = time.monotonic()
+    if now - _last_logged[0] >= WS_METRICS_LOG_INTERVAL:
+        delta = shed_load - _last_logged[1]
+        logger.warning(
+            'Websocket load shed in the last %ds: %s', now - _last_logged[0],
+            ', '.join(f'{key}={value}' for key, value in sorted(delta.items())),
+        )
+        _last_logged[0], _last_logged[1] = now, shed_load.copy()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class BucketRegistry:
+    """Token buckets per key (a group or call id), LRU-bounded."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def allow(self, key, cost=1):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.allow(cost)
+
+
+chat_group_limits = BucketRegistry(CHAT_GROUP_RATE, CHAT_GROUP_BURST)
+call_limits = BucketRegistry(CALL_GROUP_RATE, CALL_GROUP_BURST)
+
+
+class OutboundQueue:
+    """Bounded send queue for one socket, drained by a single writer task."""
+
+    def __init__(self, send, maxsize=WS_SEND_QUEUE_SIZE):
+        self.send = send
+        self.maxsize = maxsize
+        self.frames = deque()
+        # coalesce key -> its queued entry
+        self.keyed = {}
+        self.ready = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._drain())
+
+    def put(self, text, key=None):
+        if key is not None and key in self.keyed:
+            self.keyed[key][1] = text
+            count_shed('outbound_coalesced')
+            return
+        if len(self.frames) >= self.maxsize:
+            dropped_key, _ = self.frames.popleft()
+            self.keyed.pop(dropped_key, None)
+            count_shed('outbound_dropped')
+        entry = [key, text]
+        self.frames.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        self.ready.set()
+
+    async def _drain(self):
+        while True:
+            await self.ready.wait()
+            while self.frames:
+                key, text = self.frames.popleft()
+                if key is not None:
+                    self.keyed.pop(key, None)
+                await self.send(text_data=text)
+            self.ready.clear()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+class FlowControlMixin:
+    """Rate limiting and a bounded outbound queue for a websocket consumer.
+
+    Call start_flow_control() once the socket is accepted and
+    stop_flow_control() on disconnect, send frames with queue_frame(), and
+    gate each inbound frame with admit_frame() and admit().
+    """
+
+    def start_flow_control(self):
+        self.violations = 0
+        self.outbox = OutboundQueue(self.send)
+        self.outbox.start()
+
+    def stop_flow_control(self):
+        if hasattr(self, 'outbox'):
+            self.outbox.stop()
+
+    def queue_frame(self, frame, key=None):
+        self.outbox.put(json.dumps(frame), key)
+
+    def admit_frame(self, text_data):
+        """False for binary frames and frames too large to parse."""
+        if text_data is None or len(text_data) > WS_MAX_FRAME_BYTES:
+            count_shed('frame_too_large')
+            return False
+        return True
+
+    async def admit(self, bucket, registry=None, key=None):
+        """Charge ``bucket``, and ``registry``'s bucket for ``key`` if given.
+        Returns False if the frame should be dropped."""
+        if not bucket.allow():
+            reason = 'connection_rate_limited'
+        elif registry is not None and not registry.allow(key):
+            reason = 'group_rate_limited'
+        else:
+            self.violations = 0
+            return True
+
+        count_shed(reason)
+        self.violations += 1
+        if self.violations == WS_MAX_VIOLATIONS:
+            count_shed('closed_for_flooding')
+            await self.close(code=CLOSE_RATE_LIMITED)
+        elif self.violations == 1:
+            # Once per run of dropped frames, not once per frame
+            self.queue_frame({'type': 'error', 'message': 'Rate limited'}, key='rate_limited')
+        return False
@@ -0,0 +1,324 @@
+# core/channel_layer.py
+#
+# A channel layer shared by every ASGI worker, without Redis or any other
+# external service. One broker process (`manage.py runchannelbroker`) holds
+# the channel queues and groups in a channels InMemoryChannelLayer, which
+# already implements per-channel capacity, message expiry, group expiry and
+# group fan-out. Workers use BrokerChannelLayer, which forwards every layer
+# call to the broker over TCP (host:port) or a Unix socket (unix:/path).
+#
+# Frames are a 4-byte big-endian length followed by a JSON object, so
+# messages must be JSON-serializable (everything the chat and call
+# consumers send is). Requests carry an id and are answered out of order,
+# so a worker's many blocked receive() calls share one connection per event
+# loop. A cancelled receive() is cancelled on the broker too; if the broker
+# had already taken a message off the channel for it, the worker sends the
+# message back to the channel (behind anything sent since) instead of
+# dropping it.
+import asyncio
+import hmac
+import json
+import logging
+import random
+import string
+import struct
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 8 * 1024 * 1024
+
+# Layer methods the broker will run on behalf of a client
+BROKER_OPERATIONS = {'send', 'receive', 'group_add', 'group_discard', 'group_send', 'flush'}
+
+
+class BrokerError(Exception):
+    pass
+
+
+async def read_frame(reader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise BrokerError(f'Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit')
+    return json.loads(await reader.readexactly(size))
+
+
+def write_frame(writer, frame):
+    body = json.dumps(frame, separators=(',', ':')).encode()
+    # One write per frame, so frames from concurrent coroutines never interleave
+    writer.write(HEADER.pack(len(body)) + body)
+
+
+async def open_connection(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[len('unix:'):])
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+def _error_frame(request_id, exc):
+    return {'id': request_id, 'error': {'type': type(exc).__name__, 'message': str(exc)}}
+
+
+def _raise_error(error):
+    if error['type'] == 'ChannelFull':
+        raise ChannelFull(error['message'])
+    if error['type'] == 'TypeError':
+        raise TypeError(error['message'])
+    raise BrokerError(f"{error['type']}: {error['message']}")
+
+
+class ChannelBroker:
+    """Serves one InMemoryChannelLayer to any number of worker connections."""
+
+    def __init__(self, layer, token=None):
+        self.layer = layer
+        self.token = token
+
+    async def serve(self, address):
+        if address.startswith('unix:'):
+            return await asyncio.start_unix_server(self.handle, address[len('unix:'):])
+        host, port = address.rsplit(':', 1)
+        return await asyncio.start_server(self.handle, host, int(port))
+
+    async def handle(self, reader, writer):
+        authenticated = self.token is None
+        receives = {}
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                request_id, op, args = frame.get('id'), frame.get('op'), frame.get('args', [])
+
+                if op == 'auth':
+                    authenticated = self.token is None or hmac.compare_digest(str(args[0]), self.token)
+                    if not authenticated:
+                        write_frame(writer, _error_frame(request_id, BrokerError('Invalid token')))
+                        break
+                    write_frame(writer, {'id': request_id, 'result': None})
+                elif not authenticated:
+                    write_frame(writer, _error_frame(request_id, BrokerError('Not authenticated')))
+                    break
+                elif op == 'cancel':
+                    # A receive still waiting has not taken a message yet;
+                    # one that has is already answered and is not in here
+                    task = receives.pop(args[0], None)
+                    if task is not None:
+                        task.cancel()
+                        write_frame(writer, {'id': args[0], 'cancelled': True})
+                elif op == 'receive':
+                    # Receives block until a message arrives, so they run as
+                    # tasks and answer whenever they complete
+                    receives[request_id] = asyncio.ensure_future(
+                        self._receive(writer, request_id, args, receives)
+                    )
+                    continue
+                elif op in BROKER_OPERATIONS:
+                    try:
+                        result = await getattr(self.layer, op)(*args)
+                        write_frame(writer, {'id': request_id, 'result': result})
+                    except Exception as e:
+                        write_frame(writer, _error_frame(request_id, e))
+                else:
+                    write_frame(writer, _error_frame(request_id, BrokerError(f'Unknown operation {op!r}')))
+                await writer.drain()
+        finally:
+            for task in receives.values():
+                task.cancel()
+            writer.close()
+
+    async def _receive(self, writer, request_id, args, receives):
+        try:
+            message = await self.layer.receive(*args)
+            write_frame(writer, {'id': request_id, 'result': message})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            write_frame(writer, _error_frame(request_id, e))
+        finally:
+            receives.pop(request_id, None)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+class BrokerConnection:
+    def __init__(self, address, token=None):
+        self.address = address
+        self.token = token
+        self.pending = {}
+        # Request id -> channel of each cancelled receive the broker has not
+        # answered yet
+        self.abandoned = {}
+        self.next_id = 0
+        self.closed = False
+
+    async def open(self):
+        self.reader, self.writer = await open_connection(self.address)
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+        if self.token is not None:
+            await self.call('auth', self.token)
+
+    async def call(self, op, *args):
+        if self.closed:
+            raise ConnectionError(f'Channel broker connection to {self.address} is closed')
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            write_frame(self.writer, {'id': request_id, 'op': op, 'args': args})
+            await self.writer.drain()
+            return await future
+        except asyncio.CancelledError:
+            if op == 'receive' and not self.closed:
+                self._abandon(request_id, args[0], future)
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    def _abandon(self, request_id, channel, future):
+        if future.done() and not future.cancelled():
+            # The message arrived just before the caller was cancelled
+            if future.exception() is None:
+                asyncio.ensure_future(self._requeue(channel, future.result()))
+            return
+        self.abandoned[request_id] = channel
+        write_frame(self.writer, {'id': None, 'op': 'cancel', 'args': [request_id]})
+
+    async def _requeue(self, channel, message):
+        try:
+            await self.call('send', channel, message)
+        except Exception as e:
+            logger.warning(f"Dropped a message for {channel} after its receive was cancelled: {str(e)}")
+
+    async def _read_loop(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                channel = self.abandoned.pop(frame.get('id'), None)
+                if channel is not None:
+                    # The broker answers a cancelled receive either with
+                    # 'cancelled' or with the message it had already taken
+                    if 'result' in frame:
+                        asyncio.ensure_future(self._requeue(channel, frame['result']))
+                    continue
+                future = self.pending.get(frame.get('id'))
+                if future is None or future.done():
+                    continue
+                if 'error' in frame:
+                    try:
+                        _raise_error(frame['error'])
+                    except Exception as e:
+                        future.set_exception(e)
+                else:
+                    future.set_result(frame.get('result'))
+        except (asyncio.IncompleteReadError, ConnectionError, BrokerError) as e:
+            logger.warning(f"Channel broker connection lost: {str(e)}")
+        finally:
+            self.closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f'Channel broker connection to {self.address} was lost'))
+            self.writer.close()
+
+    async def close(self):
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    """Channel layer client for a ChannelBroker.
+
+    Capacity and expiry are enforced by the broker, which reads them from
+    the same CONFIG, so one CHANNEL_LAYERS entry configures both sides.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, address='127.0.0.1:8765', token=None, expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.address = address
+        self.token = token
+        self.group_expiry = group_expiry
+        # One connection per event loop; asyncio streams cannot be shared
+        # across loops
+        self.connections = {}
+        self.connection_locks = {}
+
+    def broker_layer(self):
+        """The InMemoryChannelLayer the broker serves for this configuration."""
+        return InMemoryChannelLayer(
+            expiry=self.expiry,
+            group_expiry=self.group_expiry,
+            capacity=self.capacity,
+            channel_capacity=self.channel_capacity,
+        )
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        # async_to_sync callers (signals, sync views) get a new loop per
+        # call; forget connections whose loop has since been closed
+        for stale in [other for other in self.connection_locks if other.is_closed()]:
+            del self.connection_locks[stale]
+            self.connections.pop(stale, None)
+        lock = self.connection_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            connection = self.connections.get(loop)
+            if connection is None or connection.closed:
+                connection = BrokerConnection(self.address, self.token)
+                await connection.open()
+                self.connections[loop] = connection
+        return connection
+
+    async def _call(self, op, *args):
+        connection = await self._connection()
+        return await connection.call(op, *args)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        await self._call('send', channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        return await self._call('receive', channel)
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.broker!%s' % (
+            prefix,
+            ''.join(random.choice(string.ascii_letters) for i in range(16)),
+        )
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._call('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._call('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._call('group_send', group, message)
+
+    async def flush(self):
+        await self._call('flush')
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        connection = self.connections.pop(loop, None)
+        if connection is not None:
+            await connection.close()
@@ -0,0 +1,89 @@
+# core/chat_history.py
+#
+# Recent chat history served from memory. Opening a group chat used to read
+# the newest 50 GroupMessage rows (plus senders) for every member, every
+# time. Now it is assembled from two cached pieces:
+#
+#   * the replay ring (core/chat_replay.py), which every chat write path
+#     already feeds with each message's serialized event as it is sent;
+#   * a snapshot of the group's newest CHAT_HISTORY_SIZE messages read from
+#     the database, stamped with the group's sequence number at the time.
+#
+# When the ring alone holds a page of messages, nothing else is read. Else
+# the snapshot fills in older messages, for as long as the ring still holds
+# every message sent since the snapshot was taken; after that it is
+# rebuilt. Both only hold every worker's messages when the cache is shared
+# (see core/chat_replay.py). With a per-process cache there is no ring, and
+# the snapshot is used only while its newest message is still the group's
+# newest in the database, one probe of the (group, id) index.
+#
+# Scrolling further up pages by message id (ids grow with time), from the
+# same cached history while it reaches and from the database after that.
+from django.conf import settings
+from django.core.cache import cache
+
+from .chat_replay import cache_is_shared, current_seq, tail
+from .chat_stream import message_event
+from .models import GroupMessage
+
+CHAT_HISTORY_SIZE = getattr(settings, 'CHAT_HISTORY_SIZE', 100)
+CHAT_HISTORY_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+CHAT_HISTORY_CACHE_TIMEOUT = getattr(settings, 'CHAT_HISTORY_CACHE_TIMEOUT', 15 * 60)
+
+
+def history_key(group_id):
+    return f'chat_history:{group_id}'
+
+
+def _load_snapshot(group_id):
+    # Read the sequence first: anything sent after this point is in the ring
+    seq = current_seq(group_id)
+    messages = (
+        GroupMessage.objects
+        .filter(group_id=group_id)
+        .select_related('sender')
+        .order_by('-id')[:CHAT_HISTORY_SIZE]
+    )
+    snapshot = {'seq': seq, 'events': [message_event(message, message.sender) for message in messages]}
+    cache.set(history_key(group_id), snapshot, CHAT_HISTORY_CACHE_TIMEOUT)
+    return snapshot
+
+
+def _is_current(snapshot, group_id, first_seq):
+    if snapshot is None:
+        return False
+    if cache_is_shared():
+        # The ring holds everything sent since the snapshot
+        return snapshot['seq'] + 1 >= first_seq
+    newest_id = snapshot['events'][0]['id'] if snapshot['events'] else None
+    return newest_id == (
+        GroupMessage.objects.filter(group_id=group_id).order_by('-id').values_list('id', flat=True).first()
+    )
+
+
+def recent_messages(group_id, limit=CHAT_HISTORY_PAGE_SIZE):
+    """The group's newest ``limit`` messages as message events, newest first."""
+    events, current = tail(group_id, CHAT_HISTORY_SIZE)
+    if len(events) < limit:
+        first_seq = events[0]['seq'] if events else current + 1
+        snapshot = cache.get(history_key(group_id))
+        if not _is_current(snapshot, group_id, first_seq):
+            snapshot = _load_snapshot(group_id)
+        by_id = {event['id']: event for event in snapshot['events']}
+        by_id.update((event['id'], event) for event in events)
+        events = sorted(by_id.values(), key=lambda event: event['id'])
+    return events[::-1][:limit]
+
+
+def older_messages(group_id, before_id, limit=CHAT_HISTORY_PAGE_SIZE):
+    """Up to ``limit`` messages older than ``before_id``, newest first."""
+    older = [event for event in recent_messages(group_id, CHAT_HISTORY_SIZE) if event['id'] < before_id]
+    if len(older) >= limit:
+        return older[:limit]
+    messages = (
+        GroupMessage.objects
+        .filter(group_id=group_id, id__lt=before_id)
+        .select_related('sender')
+        .order_by('-id')[:limit]
+    )
+    return [message_event(message, message.sender) for message in messages]
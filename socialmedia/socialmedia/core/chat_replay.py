@@ -0,0 +1,95 @@
+# core/chat_replay.py
+#
+# Per-group sequence numbers and a replay ring for chat broadcasts, so a
+# client that reconnects gets the messages it missed from memory instead of
+# the database.
+#
+# Each message broadcast is stamped with the next number from the group's
+# counter (cache.incr) and stored in slot seq % CHAT_REPLAY_SIZE of the
+# group's ring. A reconnecting client sends the seq and id of the last
+# message it has. The gap is replayed from the ring when:
+#
+#   * the client's own slot still holds its message, so the counter has not
+#     restarted and the slot has not been reused, and
+#   * every slot after it up to the current seq holds the expected seq.
+#
+# Otherwise the caller falls back to the database. The ring lives in the
+# cache, so every worker needs to share it (see CACHES in settings). With a
+# per-process cache each worker would number a group's messages on its own,
+# and a client would see a gap at nearly every message from another worker;
+# so messages are not numbered at all, nothing is replayed, and every
+# catch-up reads the database.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+CHAT_REPLAY_SIZE = getattr(settings, 'CHAT_REPLAY_SIZE', 256)
+CHAT_REPLAY_TTL = getattr(settings, 'CHAT_REPLAY_TTL', 15 * 60)
+
+
+def cache_is_shared():
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def sequence_key(group_id):
+    return f'chat_seq:{group_id}'
+
+
+def slot_key(group_id, seq):
+    return f'chat_replay:{group_id}:{seq % CHAT_REPLAY_SIZE}'
+
+
+def record(group_id, event):
+    """Stamp ``event`` with the group's next sequence number and keep it for
+    replay. Returns the event, unnumbered if the cache is not shared."""
+    if not cache_is_shared():
+        return event
+    key = sequence_key(group_id)
+    cache.add(key, 0, None)
+    try:
+        seq = cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); start the group over
+        cache.add(key, 0, None)
+        seq = cache.incr(key)
+    event['seq'] = seq
+    cache.set(slot_key(group_id, seq), event, CHAT_REPLAY_TTL)
+    return event
+
+
+def current_seq(group_id):
+    return cache.get(sequence_key(group_id), 0)
+
+
+def replay(group_id, last_seq, last_id):
+    """Return the events after (last_seq, last_id), oldest first, or None if
+    the ring no longer covers the gap."""
+    current = cache.get(sequence_key(group_id))
+    if current is None or not 0 < last_seq <= current or current - last_seq >= CHAT_REPLAY_SIZE:
+        return None
+    seqs = range(last_seq, current + 1)
+    slots = cache.get_many([slot_key(group_id, seq) for seq in seqs])
+    events = [slots.get(slot_key(group_id, seq)) for seq in seqs]
+    if any(event is None or event['seq'] != seq for seq, event in zip(seqs, events)):
+        return None
+    anchor, gap = events[0], events[1:]
+    if anchor['id'] != last_id:
+        return None
+    return gap
+
+
+def tail(group_id, limit=CHAT_REPLAY_SIZE):
+    """Return (events, current seq): the newest run of consecutive events
+    still in the ring, at most ``limit`` of them, oldest first."""
+    current = cache.get(sequence_key(group_id)) or 0
+    seqs = range(max(1, current - min(limit, CHAT_REPLAY_SIZE) + 1), current + 1)
+    slots = cache.get_many([slot_key(group_id, seq) for seq in seqs])
+    events = []
+    for seq in reversed(seqs):
+        event = slots.get(slot_key(group_id, seq))
+        if event is None or event['seq'] != seq:
+            break
+        events.append(event)
+    events.reverse()
+    return events, current
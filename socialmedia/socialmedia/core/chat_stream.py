@@ -0,0 +1,226 @@
+# core/chat_stream.py
+#
+# Server-Sent Events stream for group chat, replacing chat.js's 10-second
+# poll of get_group_messages. The view runs under ASGI and holds one
+# connection open per chat tab. It subscribes a channel to the group's
+# channel-layer group, the same one the chat consumer broadcasts to, and
+# waits on it. Nothing is queried while the chat is quiet; the stream only
+# wakes when a message or a presence change is broadcast.
+#
+# On connect the stream sends the messages the client missed and one
+# snapshot of the online members. Missed messages come from the replay ring
+# (core/chat_replay.py) when the client sends its last sequence number,
+# either as ``last_seq`` or in the "seq:id" Last-Event-ID EventSource sends
+# on reconnect; otherwise from the database, after ``last_id``. After that
+# it sends only:
+#
+#   event: message    one new message; "seq:id" is the SSE event id
+#   event: presence   {"user_id", "username", "online"} when a member's
+#                     stream opens or closes
+#   event: removed    {"group_id"} when the user leaves or is removed from
+#                     the group; the stream ends after it
+#
+# Streams end after CHAT_STREAM_MAX_AGE seconds, and EventSource reconnects
+# from the last event id, so no connection is held forever.
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from .chat_replay import replay
+from .memberships import is_group_member
+from .models import GroupMessage, User
+
+CHAT_STREAM_KEEPALIVE = getattr(settings, 'CHAT_STREAM_KEEPALIVE', 25)
+CHAT_STREAM_MAX_AGE = getattr(settings, 'CHAT_STREAM_MAX_AGE', 15 * 60)
+CHAT_STREAM_RETRY_MS = getattr(settings, 'CHAT_STREAM_RETRY_MS', 3000)
+CHAT_STREAM_BACKFILL_LIMIT = getattr(settings, 'CHAT_STREAM_BACKFILL_LIMIT', 200)
+# last_seen is what the presence snapshot reads; refresh it often enough
+# that a member with an open stream never looks offline
+CHAT_PRESENCE_WINDOW = getattr(settings, 'CHAT_PRESENCE_WINDOW', timedelta(minutes=5))
+CHAT_PRESENCE_REFRESH = getattr(settings, 'CHAT_PRESENCE_REFRESH', 4 * 60)
+
+
+def chat_group_name(group_id):
+    return f'group_{group_id}'
+
+
+def message_event(message, sender):
+    """The channel-layer event broadcast for a new GroupMessage."""
+    return {
+        'type': 'chat_message',
+        'group_id': message.group_id,
+        'id': message.id,
+        'message': message.content,
+        'sender': sender.username,
+        'sender_id': sender.id,
+        'sender_avatar': sender.profile_picture.url if sender.profile_picture else '',
+        'sent_at': message.timestamp.isoformat(),
+        'timestamp': message.timestamp.strftime('%H:%M'),
+    }
+
+
+def presence_event(group_id, user, online):
+    return {
+        'type': 'chat_presence',
+        'group_id': group_id,
+        'user_id': user.id,
+        'username': user.username,
+        'online': online,
+    }
+
+
+def member_removed_event(group_id, user_ids):
+    """Broadcast when members leave or are removed, so their open sockets
+    and streams stop receiving the group's chat."""
+    return {
+        'type': 'chat_member_removed',
+        'group_id': group_id,
+        'user_ids': list(user_ids),
+    }
+
+
+def call_member_removed_event(call_id, user_ids):
+    return {
+        'type': 'call_member_removed',
+        'call_id': call_id,
+        'user_ids': list(user_ids),
+    }
+
+
+def sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def message_data(event, user_id):
+    return {
+        'id': event['id'],
+        'content': event['message'],
+        'sender': event['sender'],
+        'sender_avatar': event['sender_avatar'],
+        'timestamp': event['sent_at'],
+        'is_self': event['sender_id'] == user_id,
+    }
+
+
+def event_id(event):
+    if 'seq' in event:
+        return f"{event['seq']}:{event['id']}"
+    return event['id']
+
+
+def parse_position(value):
+    """Parse "seq:id" or a bare message id into (seq, id)."""
+    seq, _, message_id = str(value or '').rpartition(':')
+    try:
+        return int(seq or 0), int(message_id or 0)
+    except ValueError:
+        return 0, 0
+
+
+def missed_events(group_id, last_seq, last_id):
+    """Events after the client's last message, oldest first: from the
+    replay ring when it covers the gap, otherwise from the database."""
+    if last_seq:
+        events = replay(group_id, last_seq, last_id)
+        if events is not None:
+            return events
+    return _backfill(group_id, last_id) if last_id else []
+
+
+def _backfill(group_id, last_id):
+    messages = (
+        GroupMessage.objects
+        .filter(group_id=group_id, id__gt=last_id)
+        .select_related('sender')
+        .order_by('-id')[:CHAT_STREAM_BACKFILL_LIMIT]
+    )
+    return [message_event(message, message.sender) for message in reversed(messages)]
+
+
+def _online_members(group_id):
+    return list(
+        User.objects.filter(
+            joined_groups__id=group_id,
+            last_seen__gte=timezone.now() - CHAT_PRESENCE_WINDOW,
+        ).values('id', 'username', 'profile_picture')
+    )
+
+
+def _touch(user_id):
+    User.objects.filter(id=user_id).update(last_seen=timezone.now())
+
+
+async def _stream(group_id, user, last_seq, last_id):
+    layer = get_channel_layer()
+    group_name = chat_group_name(group_id)
+    channel = await layer.new_channel()
+    # Subscribe before catching up so nothing falls in between; anything
+    # in both is dropped by id below
+    await layer.group_add(group_name, channel)
+    try:
+        await sync_to_async(_touch)(user.id)
+        await layer.group_send(group_name, presence_event(group_id, user, True))
+
+        yield f'retry: {CHAT_STREAM_RETRY_MS}\n\n'
+        sent = set()
+        for event in await sync_to_async(missed_events)(group_id, last_seq, last_id):
+            sent.add(event['id'])
+            yield sse('message', message_data(event, user.id), event_id(event))
+        online = await sync_to_async(_online_members)(group_id)
+        yield sse('presence', {'online_members': online})
+
+        started = last_touched = time.monotonic()
+        while time.monotonic() - started < CHAT_STREAM_MAX_AGE:
+            try:
+                event = await asyncio.wait_for(layer.receive(channel), CHAT_STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Comment line; keeps proxies from timing out the stream
+                yield ': keepalive\n\n'
+            else:
+                if event['type'] == 'chat_message' and event['id'] not in sent:
+                    yield sse('message', message_data(event, user.id), event_id(event))
+                elif event['type'] == 'chat_presence' and event['user_id'] != user.id:
+                    yield sse('presence', {key: event[key] for key in ('user_id', 'username', 'online')})
+                elif event['type'] == 'chat_member_removed' and user.id in event['user_ids']:
+                    yield sse('removed', {'group_id': group_id})
+                    break
+
+            if time.monotonic() - last_touched > CHAT_PRESENCE_REFRESH:
+                await sync_to_async(_touch)(user.id)
+                last_touched = time.monotonic()
+    finally:
+        await layer.group_discard(group_name, channel)
+        await layer.group_send(group_name, presence_event(group_id, user, False))
+
+
+@require_GET
+@login_required
+async def group_chat_stream(request, group_id):
+    user = await request.auser()
+    if not await sync_to_async(is_group_member)(group_id, user.id):
+        return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
+
+    last_seq, last_id = parse_position(
+        request.headers.get('Last-Event-ID')
+        or f"{request.GET.get('last_seq', '')}:{request.GET.get('last_id', '')}"
+    )
+    response = StreamingHttpResponse(_stream(group_id, user, last_seq, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,10 +1,54 @@
 import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from .models import GroupMessage, Group, GroupCall
+from .backpressure import (
+    CALL_SIGNAL_BURST, CALL_SIGNAL_RATE, CHAT_BURST, CHAT_RATE,
+    FlowControlMixin, TokenBucket, call_limits, chat_group_limits,
+)
+from .chat_replay import record
+from .chat_stream import chat_group_name, message_event, missed_events, presence_event
+from .chat_writer import chat_writer
+from . import memberships
+from .read_cursors import mark_read
 
-class GroupChatConsumer(AsyncWebsocketConsumer):
+USER_SOCKET_MAX_SUBSCRIPTIONS = getattr(settings, 'USER_SOCKET_MAX_SUBSCRIPTIONS', 100)
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def chat_position(data):
+    """The (last_seq, last_id) a subscribe frame resumes from."""
+    try:
+        return int(data.get('last_seq') or 0), int(data.get('last_id') or 0)
+    except (TypeError, ValueError):
+        return 0, 0
+
+
+async def publish_chat_message(channel_layer, group_id, user, content):
+    """Write a chat message, then broadcast it. Returns False if the write
+    was rejected, in which case nothing is broadcast."""
+    # Queued from the event loop, so messages sent while an earlier flush
+    # is running are written together by the next one
+    group_message = chat_writer.new_message(group_id, user.id, content)
+    chat_writer.enqueue(group_message)
+    await database_sync_to_async(chat_writer.flush)()
+    if group_message.pk is None:
+        return False
+
+    # Send message to group, stamped with the group's next sequence number
+    # and kept for replay
+    event = await sync_to_async(record)(group_id, message_event(group_message, user))
+    await channel_layer.group_send(chat_group_name(group_id), event)
+    return True
+
+
+class GroupChatConsumer(FlowControlMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.group_id = self.scope['url_route']['kwargs']['group_id']
         self.group_name = f'group_{self.group_id}'
@@ -15,61 +59,95 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        self.joined = True
+        self.last_delivered_id = None
+        self.bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
         await self.accept()
+        self.start_flow_control()
+        await self.channel_layer.group_send(self.group_name, presence_event(int(self.group_id), self.user, True))
+
+        # A reconnecting client passes ?last_seq=&last_id= for the last
+        # message it has; replay what it missed, from memory when possible.
+        # Subscribing first means live events may repeat replayed ones, so
+        # those are skipped by id.
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            last_seq = int(query.get('last_seq', ['0'])[0])
+            last_id = int(query.get('last_id', ['0'])[0])
+        except ValueError:
+            last_seq = last_id = 0
+        self.replayed = set()
+        for event in await sync_to_async(missed_events)(int(self.group_id), last_seq, last_id):
+            await self.chat_message(event)
+            self.replayed.add(event['id'])
 
     async def disconnect(self, close_code):
+        self.stop_flow_control()
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
+        if not getattr(self, 'joined', False):
+            return
+        await self.channel_layer.group_send(self.group_name, presence_event(int(self.group_id), self.user, False))
+        # Everything delivered while connected counts as read; one cursor
+        # update per session rather than one per message
+        if self.last_delivered_id:
+            await database_sync_to_async(mark_read)(self.user.id, self.group_id, self.last_delivered_id)
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+    async def receive(self, text_data=None, bytes_data=None):
+        if not self.admit_frame(text_data):
+            return
+        if not await self.admit(self.bucket, chat_group_limits, int(self.group_id)):
+            return
+        try:
+            message = str(json.loads(text_data).get('message', ''))
+        except (AttributeError, ValueError):
+            return
 
-        if message.strip():
-            # Save message to database
-            group_message = await self.create_group_message(message)
-            
-            # Send message to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender': self.user.username,
-                    'timestamp': group_message.timestamp.strftime('%H:%M'),
-                }
-            )
+        if not message.strip():
+            return
+        if not await publish_chat_message(self.channel_layer, int(self.group_id), self.user, message):
+            self.queue_frame({'type': 'error', 'message': 'Message could not be sent'})
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        if event['id'] in self.replayed:
+            return
+        self.last_delivered_id = event['id']
+        self.queue_frame({
+            'id': event['id'],
+            'seq': event.get('seq'),
             'message': event['message'],
             'sender': event['sender'],
             'timestamp': event['timestamp'],
-        }))
+        })
 
-    @database_sync_to_async
-    def is_group_member(self):
-        return Group.objects.filter(
-            id=self.group_id,
-            members=self.user
-        ).exists()
+    async def chat_presence(self, event):
+        if event['user_id'] == self.user.id:
+            return
+        # Only a member's latest presence matters; a queued one is replaced
+        self.queue_frame({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'online': event['online'],
+        }, key=('presence', event['user_id']))
+
+    async def chat_member_removed(self, event):
+        if self.user.id in event['user_ids']:
+            # The read cursor went with the membership, so nothing to mark
+            self.last_delivered_id = None
+            await self.close()
 
     @database_sync_to_async
-    def create_group_message(self, content):
-        group = Group.objects.get(id=self.group_id)
-        return GroupMessage.objects.create(
-            group=group,
-            sender=self.user,
-            content=content
-        )
+    def is_group_member(self):
+        return memberships.is_group_member(self.group_id, self.user.id)
 
-class GroupCallConsumer(AsyncWebsocketConsumer):
+class GroupCallConsumer(FlowControlMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.call_id = self.scope['url_route']['kwargs']['call_id']
         self.call_name = f'call_{self.call_id}'
@@ -80,17 +158,20 @@ class GroupCallConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        self.bucket = TokenBucket(CALL_SIGNAL_RATE, CALL_SIGNAL_BURST)
         await self.channel_layer.group_add(
             self.call_name,
             self.channel_name
         )
         await self.accept()
+        self.start_flow_control()
 
         # Notify others that user joined
         await self.channel_layer.group_send(
             self.call_name,
             {
                 'type': 'call_notification',
+                'call_id': int(self.call_id),
                 'message': f'{self.user.username} joined the call',
                 'user_id': self.user.id,
                 'action': 'join',
@@ -98,10 +179,12 @@ class GroupCallConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
+        self.stop_flow_control()
         await self.channel_layer.group_send(
             self.call_name,
             {
                 'type': 'call_notification',
+                'call_id': int(self.call_id),
                 'message': f'{self.user.username} left the call',
                 'user_id': self.user.id,
                 'action': 'leave',
@@ -112,15 +195,23 @@ class GroupCallConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        action = data.get('action')
+    async def receive(self, text_data=None, bytes_data=None):
+        if not self.admit_frame(text_data):
+            return
+        if not await self.admit(self.bucket, call_limits, int(self.call_id)):
+            return
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+        except (AttributeError, ValueError):
+            return
 
-        if action == 'signal':
+        if action == 'signal' and 'signal' in data:
             await self.channel_layer.group_send(
                 self.call_name,
                 {
                     'type': 'call_signal',
+                    'call_id': int(self.call_id),
                     'sender_id': self.user.id,
                     'signal': data['signal'],
                     'target': data.get('target'),
@@ -131,23 +222,288 @@ class GroupCallConsumer(AsyncWebsocketConsumer):
         if event['target'] and event['target'] != self.user.id:
             return
 
-        await self.send(text_data=json.dumps({
+        self.queue_frame({
             'action': 'signal',
             'sender_id': event['sender_id'],
             'signal': event['signal'],
-        }))
+        })
 
     async def call_notification(self, event):
-        await self.send(text_data=json.dumps({
+        self.queue_frame({
             'action': 'notification',
             'message': event['message'],
             'user_id': event['user_id'],
             'action_type': event['action'],
-        }))
+        })
+
+    async def call_member_removed(self, event):
+        if self.user.id in event['user_ids']:
+            await self.close()
 
     @database_sync_to_async
     def is_call_participant(self):
-        return GroupCall.objects.filter(
-            id=self.call_id,
-            group__members=self.user
-        ).exists()
\ No newline at end of file
+        return memberships.is_call_participant(self.call_id, self.user.id)
+
+class UserConsumer(FlowControlMixin, AsyncWebsocketConsumer):
+    """One socket per user for all of their group chats, calls and
+    notifications.
+
+    Notifications are pushed from connect onwards; chats and calls are
+    joined and left with frames:
+
+        {"action": "subscribe", "topic": "group", "id": 5, "last_seq": 41, "last_id": 723...}
+        {"action": "unsubscribe", "topic": "group", "id": 5}
+        {"action": "send", "topic": "group", "id": 5, "message": "hi"}
+        {"action": "subscribe", "topic": "call", "id": 9}
+        {"action": "signal", "topic": "call", "id": 9, "signal": {...}, "target": 3}
+
+    Every frame sent back carries its topic and id. However many chats are
+    open, the connection costs one consumer and one channel, and at most
+    USER_SOCKET_MAX_SUBSCRIPTIONS channel-layer group registrations.
+
+    Inbound frames are rate limited and outbound ones queued as described
+    in core/backpressure.py. Chat frames carry the group's seq; a client
+    that sees a gap subscribes again with its last seq and id, and the
+    missing messages are replayed.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+            return
+
+        # group id -> id of the last message delivered, for the read cursor
+        self.chats = {}
+        self.replayed = {}
+        self.calls = set()
+        # Chat and control frames share one bucket; call signalling, which
+        # is chattier, has its own
+        self.bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+        self.signal_bucket = TokenBucket(CALL_SIGNAL_RATE, CALL_SIGNAL_BURST)
+        await self.channel_layer.group_add(user_group_name(self.user.id), self.channel_name)
+        await self.accept()
+        self.start_flow_control()
+
+    async def disconnect(self, close_code):
+        self.stop_flow_control()
+        if not hasattr(self, 'chats'):
+            return
+        for group_id in list(self.chats):
+            await self.leave_chat(group_id)
+        for call_id in list(self.calls):
+            await self.leave_call(call_id)
+        await self.channel_layer.group_discard(user_group_name(self.user.id), self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not self.admit_frame(text_data):
+            return
+        try:
+            data = json.loads(text_data)
+            action, topic, target_id = data.get('action'), data.get('topic'), int(data.get('id'))
+        except (AttributeError, TypeError, ValueError):
+            data, action, topic, target_id = None, None, None, None
+        # A group's or call's shared budget is only charged by its own
+        # subscribers; anything else would let outsiders use it up
+        if action == 'signal':
+            admitted = await self.admit(self.signal_bucket, call_limits if target_id in self.calls else None, target_id)
+        elif action == 'send':
+            admitted = await self.admit(self.bucket, chat_group_limits if target_id in self.chats else None, target_id)
+        else:
+            admitted = await self.admit(self.bucket)
+        if not admitted:
+            return
+        if data is None:
+            await self.send_error('Frames need an action, a topic and an id')
+            return
+
+        if action == 'subscribe':
+            if topic == 'group' and target_id in self.chats:
+                # Resubscribing resyncs: the client saw a gap in the
+                # sequence, e.g. because frames were shed while it was slow
+                await self.resync_chat(target_id, data)
+                return
+            if topic == 'call' and target_id in self.calls:
+                return
+            if len(self.chats) + len(self.calls) >= USER_SOCKET_MAX_SUBSCRIPTIONS:
+                await self.send_error('Too many subscriptions')
+            elif topic == 'group':
+                if not await self.is_group_member(target_id):
+                    await self.send_error('Not a member', topic, target_id)
+                    return
+                await self.join_chat(target_id, *chat_position(data))
+            elif topic == 'call':
+                if not await self.is_call_participant(target_id):
+                    await self.send_error('Not a participant', topic, target_id)
+                    return
+                await self.join_call(target_id)
+            else:
+                await self.send_error(f'Unknown topic {topic!r}')
+        elif action == 'unsubscribe':
+            if topic == 'group' and target_id in self.chats:
+                await self.leave_chat(target_id)
+            elif topic == 'call' and target_id in self.calls:
+                await self.leave_call(target_id)
+        elif action == 'send' and topic == 'group' and target_id in self.chats:
+            message = str(data.get('message', ''))
+            if message.strip() and not await publish_chat_message(self.channel_layer, target_id, self.user, message):
+                await self.send_error('Message could not be sent', topic, target_id)
+        elif action == 'signal' and topic == 'call' and target_id in self.calls:
+            await self.channel_layer.group_send(
+                f'call_{target_id}',
+                {
+                    'type': 'call_signal',
+                    'call_id': target_id,
+                    'sender_id': self.user.id,
+                    'signal': data.get('signal'),
+                    'target': data.get('target'),
+                }
+            )
+        else:
+            await self.send_error(f'Cannot {action} on {topic} {target_id}', topic, target_id)
+
+    async def send_error(self, message, topic=None, target_id=None):
+        self.queue_frame({
+            'type': 'error',
+            'topic': topic,
+            'id': target_id,
+            'message': message,
+        }, key=('error', topic, target_id))
+
+    async def join_chat(self, group_id, last_seq, last_id):
+        self.chats[group_id] = None
+        self.replayed[group_id] = set()
+        await self.channel_layer.group_add(chat_group_name(group_id), self.channel_name)
+        await self.channel_layer.group_send(chat_group_name(group_id), presence_event(group_id, self.user, True))
+        # Same catch-up as GroupChatConsumer: replay what the client missed,
+        # then skip live events that repeat it
+        for event in await sync_to_async(missed_events)(group_id, last_seq, last_id):
+            await self.chat_message(event)
+            self.replayed[group_id].add(event['id'])
+
+    async def resync_chat(self, group_id, data):
+        last_seq, last_id = chat_position(data)
+        if not last_id:
+            return
+        self.replayed[group_id] = set()
+        for event in await sync_to_async(missed_events)(group_id, last_seq, last_id):
+            await self.chat_message(event)
+            self.replayed[group_id].add(event['id'])
+
+    async def leave_chat(self, group_id):
+        last_delivered_id = self.chats.pop(group_id)
+        self.replayed.pop(group_id, None)
+        await self.channel_layer.group_discard(chat_group_name(group_id), self.channel_name)
+        await self.channel_layer.group_send(chat_group_name(group_id), presence_event(group_id, self.user, False))
+        if last_delivered_id:
+            await database_sync_to_async(mark_read)(self.user.id, group_id, last_delivered_id)
+
+    async def join_call(self, call_id):
+        self.calls.add(call_id)
+        await self.channel_layer.group_add(f'call_{call_id}', self.channel_name)
+        await self.channel_layer.group_send(
+            f'call_{call_id}',
+            {
+                'type': 'call_notification',
+                'call_id': call_id,
+                'message': f'{self.user.username} joined the call',
+                'user_id': self.user.id,
+                'action': 'join',
+            }
+        )
+
+    async def leave_call(self, call_id):
+        self.calls.discard(call_id)
+        await self.channel_layer.group_send(
+            f'call_{call_id}',
+            {
+                'type': 'call_notification',
+                'call_id': call_id,
+                'message': f'{self.user.username} left the call',
+                'user_id': self.user.id,
+                'action': 'leave',
+            }
+        )
+        await self.channel_layer.group_discard(f'call_{call_id}', self.channel_name)
+
+    async def chat_message(self, event):
+        group_id = event['group_id']
+        # Events can still be in flight for a chat that was just left
+        if group_id not in self.chats or event['id'] in self.replayed[group_id]:
+            return
+        self.chats[group_id] = event['id']
+        self.queue_frame({
+            'topic': 'group',
+            'id': group_id,
+            'type': 'chat_message',
+            'message_id': event['id'],
+            'seq': event.get('seq'),
+            'message': event['message'],
+            'username': event['sender'],
+            'user_id': event['sender_id'],
+            'timestamp': event['sent_at'],
+        })
+
+    async def chat_presence(self, event):
+        if event['group_id'] not in self.chats or event['user_id'] == self.user.id:
+            return
+        self.queue_frame({
+            'topic': 'group',
+            'id': event['group_id'],
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'online': event['online'],
+        }, key=('presence', event['group_id'], event['user_id']))
+
+    async def call_signal(self, event):
+        if event['call_id'] not in self.calls or (event['target'] and event['target'] != self.user.id):
+            return
+        self.queue_frame({
+            'topic': 'call',
+            'id': event['call_id'],
+            'type': 'signal',
+            'sender_id': event['sender_id'],
+            'signal': event['signal'],
+        })
+
+    async def call_notification(self, event):
+        if event['call_id'] not in self.calls:
+            return
+        self.queue_frame({
+            'topic': 'call',
+            'id': event['call_id'],
+            'type': 'notification',
+            'message': event['message'],
+            'user_id': event['user_id'],
+            'action': event['action'],
+        })
+
+    async def notification(self, event):
+        self.queue_frame({
+            'topic': 'notifications',
+            'type': 'notification',
+            **event['notification'],
+        })
+
+    async def chat_member_removed(self, event):
+        group_id = event['group_id']
+        if group_id in self.chats and self.user.id in event['user_ids']:
+            # The read cursor went with the membership, so nothing to mark
+            self.chats[group_id] = None
+            await self.leave_chat(group_id)
+            await self.send_error('Removed from the group', 'group', group_id)
+
+    async def call_member_removed(self, event):
+        call_id = event['call_id']
+        if call_id in self.calls and self.user.id in event['user_ids']:
+            await self.leave_call(call_id)
+            await self.send_error('Removed from the group', 'call', call_id)
+
+    @database_sync_to_async
+    def is_group_member(self, group_id):
+        return memberships.is_group_member(group_id, self.user.id)
+
+    @database_sync_to_async
+    def is_call_participant(self, call_id):
+        return memberships.is_call_participant(call_id, self.user.id)
@@ -0,0 +1,176 @@
+# core/content_search.py
+#
+# Full-text search over Post, GroupPost and Comment content. Documents are
+# tokenized when they are written (the model signals call index() on save
+# and remove() on delete), so a search only reads the index. There are two
+# backends with the same interface:
+#
+#  * FTS5Backend keeps an SQLite FTS5 table (core_content_fts) in the
+#    default database and ranks with bm25(). Used for local development and
+#    tests when the database is SQLite.
+#  * PostingsBackend keeps term postings in ContentSearchTerm and works on
+#    any database. Documents must contain every query term and are ranked by
+#    term frequency weighted by how rare each term is.
+#
+# CONTENT_SEARCH_BACKEND picks one explicitly ('fts5' or 'postings'); by
+# default FTS5 is used whenever its table exists.
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, When
+
+from .models import Comment, ContentSearchTerm, GroupPost, Post
+from .search_index import tokenize
+
+CONTENT_SEARCH_BACKEND = getattr(settings, 'CONTENT_SEARCH_BACKEND', None)
+CONTENT_SEARCH_MAX_RESULTS = getattr(settings, 'CONTENT_SEARCH_MAX_RESULTS', 500)
+CONTENT_SEARCH_MAX_QUERY_TERMS = getattr(settings, 'CONTENT_SEARCH_MAX_QUERY_TERMS', 8)
+
+FTS_TABLE = 'core_content_fts'
+
+MODELS = {
+    'post': Post,
+    'grouppost': GroupPost,
+    'comment': Comment,
+}
+# FTS5 rows are keyed by one integer rowid, so the kind is packed into its
+# low bits: rowid = object_id * 4 + code
+KIND_CODES = {
+    'post': 1,
+    'grouppost': 2,
+    'comment': 3,
+}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))[:CONTENT_SEARCH_MAX_QUERY_TERMS]
+
+
+class PostingsBackend:
+    name = 'postings'
+
+    def index(self, kind, object_id, text):
+        """Bring the postings of one document in line with ``text``."""
+        wanted = Counter(tokenize(text))
+        existing = {
+            term: (posting_id, frequency)
+            for posting_id, term, frequency in
+            ContentSearchTerm.objects.filter(kind=kind, object_id=object_id)
+            .values_list('id', 'term', 'frequency')
+        }
+        stale = [posting_id for term, (posting_id, frequency) in existing.items() if wanted.get(term) != frequency]
+        new = [
+            ContentSearchTerm(term=term, kind=kind, object_id=object_id, frequency=min(frequency, 32767))
+            for term, frequency in wanted.items()
+            if existing.get(term, (None, None))[1] != frequency
+        ]
+        if not stale and not new:
+            return
+        with transaction.atomic():
+            if stale:
+                ContentSearchTerm.objects.filter(id__in=stale).delete()
+            ContentSearchTerm.objects.bulk_create(new)
+
+    def remove(self, kind, object_id):
+        ContentSearchTerm.objects.filter(kind=kind, object_id=object_id).delete()
+
+    def clear(self):
+        ContentSearchTerm.objects.all().delete()
+
+    def search(self, query, kinds, limit=CONTENT_SEARCH_MAX_RESULTS):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        postings = ContentSearchTerm.objects.filter(term__in=terms, kind__in=kinds)
+        document_frequency = dict(postings.values_list('term').annotate(n=Count('*')).order_by())
+        if len(document_frequency) < len(terms):
+            return []  # some term matches nothing, so no document has them all
+
+        # Rarer terms count for more; 1 + log(df) keeps common terms above zero
+        score = Case(
+            *[When(term=term, then=F('frequency') / (1.0 + math.log(df)))
+              for term, df in document_frequency.items()],
+            output_field=FloatField(),
+        )
+        rows = (
+            postings.values('kind', 'object_id')
+            .annotate(matched=Count('term'), score=Sum(score))
+            .filter(matched=len(terms))
+            .order_by('-score', '-object_id')[:limit]
+        )
+        return [(row['kind'], row['object_id']) for row in rows]
+
+
+class FTS5Backend:
+    name = 'fts5'
+
+    def index(self, kind, object_id, text):
+        rowid = object_id * 4 + KIND_CODES[kind]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [rowid])
+            cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, body) VALUES (%s, %s)', [rowid, text])
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [object_id * 4 + KIND_CODES[kind]])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def search(self, query, kinds, limit=CONTENT_SEARCH_MAX_RESULTS):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # Quote every term so user input is never parsed as FTS5 syntax;
+        # space-separated phrases are ANDed together
+        match = ' '.join(f'"{term}"' for term in terms)
+        codes = [KIND_CODES[kind] for kind in kinds]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid %% 4 IN ({", ".join(["%s"] * len(codes))}) '
+                f'ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT %s',
+                [match, *codes, limit],
+            )
+            return [(KIND_NAMES[rowid % 4], rowid // 4) for rowid, in cursor.fetchall()]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = CONTENT_SEARCH_BACKEND
+        if name is None:
+            name = 'fts5' if FTS_TABLE in connection.introspection.table_names() else 'postings'
+        _backend = FTS5Backend() if name == 'fts5' else PostingsBackend()
+    return _backend
+
+
+def index_document(kind, obj):
+    get_backend().index(kind, obj.pk, obj.content)
+
+
+def remove_document(kind, obj):
+    get_backend().remove(kind, obj.pk)
+
+
+def search_content(query, kinds=tuple(MODELS), limit=CONTENT_SEARCH_MAX_RESULTS):
+    """Return up to ``limit`` (kind, object_id) pairs matching ``query``, best first."""
+    return get_backend().search(query, kinds, limit)
+
+
+def rebuild(batch_size=1000):
+    backend = get_backend()
+    backend.clear()
+    count = 0
+    for kind, model in MODELS.items():
+        for object_id, content in model.objects.values_list('id', 'content').iterator(chunk_size=batch_size):
+            backend.index(kind, object_id, content)
+            count += 1
+    return count
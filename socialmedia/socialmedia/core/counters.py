@@ -0,0 +1,65 @@
+# core/counters.py
+#
+# Helpers for the denormalized like_count/comment_count/member_count
+# columns. Comment and member counts are updated with F-expressions so
+# concurrent writers never overwrite each other. Like counts are recounted
+# for the touched posts whenever the like buffer flushes, and
+# reconcile_all() repairs drift across the table.
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Group, GroupPost, Post
+
+
+def adjust_counter(model, pk, field, delta):
+    # Greatest() keeps the column from going negative if it had drifted
+    model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def _count_subquery(queryset, fk_field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{fk_field: OuterRef('pk')})
+            .order_by()
+            .values(fk_field)
+            .annotate(total=Count('*'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def reconcile_counter(model, field, actual, ids=None):
+    """Rewrite ``field`` on rows of ``model`` where it differs from ``actual``.
+
+    Checks every row, or only the rows in ``ids`` when given.
+    """
+    drifted = model.objects.annotate(actual=actual).exclude(**{field: F('actual')})
+    if ids is not None:
+        drifted = drifted.filter(pk__in=ids)
+    ids = list(drifted.values_list('pk', flat=True))
+    if ids:
+        model.objects.filter(pk__in=ids).update(**{field: actual})
+    return len(ids)
+
+
+def _like_count_subquery(model):
+    field = model._meta.get_field('likes')
+    return _count_subquery(field.remote_field.through.objects, f'{field.m2m_field_name()}_id')
+
+
+def refresh_like_counts(model, ids):
+    return reconcile_counter(model, 'like_count', _like_count_subquery(model), ids)
+
+
+def reconcile_all():
+    return {
+        'post.like_count': reconcile_counter(Post, 'like_count', _like_count_subquery(Post)),
+        'post.comment_count': reconcile_counter(
+            Post, 'comment_count', _count_subquery(Comment.objects, 'post_id')
+        ),
+        'grouppost.like_count': reconcile_counter(GroupPost, 'like_count', _like_count_subquery(GroupPost)),
+        'group.member_count': reconcile_counter(
+            Group, 'member_count', _count_subquery(Group.members.through.objects, 'group_id')
+        ),
+    }
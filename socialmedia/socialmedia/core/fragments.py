@@ -0,0 +1,28 @@
+# core/fragments.py
+#
+# The viewer-independent part of a post card (text and media) is cached as a
+# template fragment in home.html, profile.html and for_you.html, keyed on the
+# post id and updated_at. Editing a post bumps updated_at and so switches to
+# a fresh key; deleting a post drops its fragments here. Like/comment counts
+# and the viewer's liked state sit outside the fragment and are rendered live
+# from the denormalized columns, so like and comment events never need to
+# throw the cached markup away.
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+POST_CONTENT_FRAGMENTS = (
+    'home_post_content',
+    'profile_post_content',
+    'for_you_post_content',
+)
+
+
+def post_fragment_keys(post):
+    return [
+        make_template_fragment_key(fragment_name, [post.id, post.updated_at])
+        for fragment_name in POST_CONTENT_FRAGMENTS
+    ]
+
+
+def invalidate_post_fragments(post):
+    cache.delete_many(post_fragment_keys(post))
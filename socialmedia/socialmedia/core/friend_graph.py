@@ -0,0 +1,151 @@
+# core/friend_graph.py
+#
+# In-memory index of the friendship graph. Each user's friends are kept as a
+# sorted array of ids ('q' array: 8 bytes per edge, no per-int objects), so
+# are_friends() is a binary search and mutual friends is a merge of two
+# sorted arrays. Adjacency is loaded lazily, one query per batch of users,
+# and kept in an LRU bounded by FRIEND_GRAPH_MAX_USERS. The friends M2M
+# signal patches loaded entries in place; FRIEND_GRAPH_TTL bounds how long
+# another process's changes can go unseen.
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import User
+
+FRIEND_GRAPH_MAX_USERS = getattr(settings, 'FRIEND_GRAPH_MAX_USERS', 100000)
+FRIEND_GRAPH_TTL = getattr(settings, 'FRIEND_GRAPH_TTL', 300)
+
+
+def _contains(ids, value):
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+def _intersect(a, b):
+    # Walk the smaller array and binary search the larger one; with a
+    # lower bound that only moves forward this is O(m log n) for m <= n.
+    if len(a) > len(b):
+        a, b = b, a
+    common = array('q')
+    lo = 0
+    for value in a:
+        lo = bisect_left(b, value, lo)
+        if lo == len(b):
+            break
+        if b[lo] == value:
+            common.append(value)
+    return common
+
+
+class FriendGraph:
+    def __init__(self, max_users=FRIEND_GRAPH_MAX_USERS, ttl=FRIEND_GRAPH_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # user id -> (loaded at, sorted array of friend ids)
+        self.adjacency = OrderedDict()
+
+    def _cached(self, user_id, now):
+        entry = self.adjacency.get(user_id)
+        if entry is None or now - entry[0] > self.ttl:
+            return None
+        self.adjacency.move_to_end(user_id)
+        return entry[1]
+
+    def _store(self, user_id, friend_ids, now):
+        self.adjacency[user_id] = (now, friend_ids)
+        self.adjacency.move_to_end(user_id)
+        while len(self.adjacency) > self.max_users:
+            self.adjacency.popitem(last=False)
+
+    def load(self, user_ids):
+        """Return {user_id: sorted friend id array}, loading misses in one query."""
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for user_id in user_ids:
+                ids = self._cached(user_id, now)
+                if ids is not None:
+                    found[user_id] = ids
+        missing = [user_id for user_id in set(user_ids) if user_id not in found]
+        if not missing:
+            return found
+
+        loaded = {user_id: array('q') for user_id in missing}
+        # The friends relation is symmetrical, so every friendship is stored
+        # in both directions and from_user alone gives a user's friends
+        rows = (
+            User.friends.through.objects
+            .filter(from_user_id__in=missing)
+            .order_by('from_user_id', 'to_user_id')
+            .values_list('from_user_id', 'to_user_id')
+        )
+        for user_id, friend_id in rows.iterator():
+            loaded[user_id].append(friend_id)
+
+        with self.lock:
+            for user_id, ids in loaded.items():
+                self._store(user_id, ids, now)
+        found.update(loaded)
+        return found
+
+    def friends_of(self, user_id):
+        return self.load([user_id])[user_id]
+
+    def are_friends(self, user_id, other_id):
+        return _contains(self.friends_of(user_id), other_id)
+
+    def friend_count(self, user_id):
+        return len(self.friends_of(user_id))
+
+    def mutual_friends(self, user_id, other_id):
+        adjacency = self.load([user_id, other_id])
+        return _intersect(adjacency[user_id], adjacency[other_id])
+
+    def mutual_friend_count(self, user_id, other_id):
+        return len(self.mutual_friends(user_id, other_id))
+
+    def annotate(self, users, viewer_id):
+        """Set ``is_friend`` and ``mutual_friend_count`` on each of ``users``
+        relative to ``viewer_id``, loading any missing adjacency in one query."""
+        adjacency = self.load([viewer_id] + [user.id for user in users])
+        viewer_friends = adjacency[viewer_id]
+        for user in users:
+            user.is_friend = _contains(viewer_friends, user.id)
+            user.mutual_friend_count = len(_intersect(viewer_friends, adjacency[user.id]))
+        return users
+
+    def add_edge(self, user_id, other_id):
+        with self.lock:
+            for a, b in ((user_id, other_id), (other_id, user_id)):
+                entry = self.adjacency.get(a)
+                if entry is None:
+                    continue
+                ids = entry[1]
+                i = bisect_left(ids, b)
+                if i == len(ids) or ids[i] != b:
+                    ids.insert(i, b)
+
+    def remove_edge(self, user_id, other_id):
+        with self.lock:
+            for a, b in ((user_id, other_id), (other_id, user_id)):
+                entry = self.adjacency.get(a)
+                if entry is None:
+                    continue
+                ids = entry[1]
+                i = bisect_left(ids, b)
+                if i < len(ids) and ids[i] == b:
+                    del ids[i]
+
+    def forget(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.adjacency.pop(user_id, None)
+
+
+friend_graph = FriendGraph()
@@ -0,0 +1,143 @@
+# core/group_recommendations.py
+#
+# Precomputed "recommended groups". Each user gets a cached pool of public
+# groups they have not joined, scored from three signals:
+#
+#  * how many of their friends are members,
+#  * how many of the groups they are already in share the group's category,
+#  * how active the group has been recently (group posts).
+#
+# Activity is computed once per GROUP_ACTIVITY_CACHE_TIMEOUT for all users
+# and kept per category, so building one user's pool reads their own groups,
+# their friends' memberships and a few short lists. The groups page samples
+# a handful of ids from the pool, so its cost does not depend on how many
+# groups exist. Pools are dropped when the user's groups or friends change.
+import heapq
+import math
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .friend_graph import friend_graph
+from .models import Group, GroupPost
+
+GROUP_RECOMMENDATION_POOL_SIZE = getattr(settings, 'GROUP_RECOMMENDATION_POOL_SIZE', 24)
+GROUP_RECOMMENDATION_CACHE_TIMEOUT = getattr(settings, 'GROUP_RECOMMENDATION_CACHE_TIMEOUT', 60 * 60)
+GROUP_ACTIVITY_WINDOW = getattr(settings, 'GROUP_ACTIVITY_WINDOW', timedelta(days=7))
+GROUP_ACTIVITY_CACHE_TIMEOUT = getattr(settings, 'GROUP_ACTIVITY_CACHE_TIMEOUT', 15 * 60)
+GROUP_ACTIVITY_PER_CATEGORY = getattr(settings, 'GROUP_ACTIVITY_PER_CATEGORY', 50)
+
+FRIEND_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+ACTIVITY_WEIGHT = 0.5
+
+GroupMembers = Group.members.through
+
+ACTIVITY_KEY = 'group_recs:activity'
+
+
+def recommendations_key(user_id):
+    return f'group_recs:{user_id}'
+
+
+def active_groups():
+    """Return {category: [(group_id, recent post count), ...]} for public groups.
+
+    Each list holds the most active groups of that category, busiest first;
+    the None entry is the overall list, used for users with no signals yet.
+    """
+    activity = cache.get(ACTIVITY_KEY)
+    if activity is not None:
+        return activity
+
+    since = timezone.now() - GROUP_ACTIVITY_WINDOW
+    rows = list(
+        GroupPost.objects.filter(created_at__gte=since, group__privacy='public')
+        .values_list('group_id', 'group__category')
+        .annotate(posts=Count('*'))
+        .order_by()
+    )
+    by_category = {}
+    for group_id, category, posts in rows:
+        by_category.setdefault(category, []).append((posts, group_id))
+        by_category.setdefault(None, []).append((posts, group_id))
+    # The newest groups have no activity yet; list them too so new users
+    # and quiet categories still get something
+    active_ids = {group_id for group_id, _, _ in rows}
+    newest = Group.objects.filter(privacy='public').values_list('id', 'category')[:GROUP_ACTIVITY_PER_CATEGORY]
+    for group_id, category in newest:
+        if group_id not in active_ids:
+            by_category.setdefault(category, []).append((0, group_id))
+            by_category.setdefault(None, []).append((0, group_id))
+    activity = {
+        category: [(group_id, posts) for posts, group_id in heapq.nlargest(GROUP_ACTIVITY_PER_CATEGORY, groups)]
+        for category, groups in by_category.items()
+    }
+    cache.set(ACTIVITY_KEY, activity, GROUP_ACTIVITY_CACHE_TIMEOUT)
+    return activity
+
+
+def compute_recommendations(user_id):
+    """Return the user's pool as [group_id, ...], best first."""
+    joined = dict(GroupMembers.objects.filter(user_id=user_id).values_list('group_id', 'group__category'))
+    category_affinity = Counter(joined.values())
+
+    friend_ids = list(friend_graph.friends_of(user_id))
+    friend_counts = Counter()
+    if friend_ids:
+        friend_counts.update(dict(
+            GroupMembers.objects.filter(user_id__in=friend_ids, group__privacy='public')
+            .exclude(group_id__in=list(joined))
+            .values_list('group_id').annotate(n=Count('*')).order_by()
+        ))
+
+    activity = active_groups()
+    recent_posts = {}
+    for category in list(category_affinity) + [None]:
+        for group_id, posts in activity.get(category, ()):
+            recent_posts[group_id] = posts
+
+    candidate_ids = (set(friend_counts) | set(recent_posts)) - set(joined)
+    if not candidate_ids:
+        return []
+    group_categories = dict(
+        Group.objects.filter(id__in=candidate_ids, privacy='public').values_list('id', 'category')
+    )
+
+    scored = [
+        (
+            FRIEND_WEIGHT * friend_counts.get(group_id, 0)
+            + CATEGORY_WEIGHT * category_affinity.get(category, 0)
+            + ACTIVITY_WEIGHT * math.log1p(recent_posts.get(group_id, 0)),
+            group_id,
+        )
+        for group_id, category in group_categories.items()
+    ]
+    return [group_id for _, group_id in heapq.nlargest(GROUP_RECOMMENDATION_POOL_SIZE, scored)]
+
+
+def get_recommendations(user):
+    group_ids = cache.get(recommendations_key(user.id))
+    if group_ids is None:
+        group_ids = compute_recommendations(user.id)
+        cache.set(recommendations_key(user.id), group_ids, GROUP_RECOMMENDATION_CACHE_TIMEOUT)
+    return group_ids
+
+
+def sample_recommendations(user, k=4):
+    """Pick ``k`` groups at random from the user's pool, keeping pool order."""
+    group_ids = get_recommendations(user)
+    if len(group_ids) > k:
+        picked = set(random.sample(group_ids, k))
+        group_ids = [group_id for group_id in group_ids if group_id in picked]
+    groups = Group.objects.filter(privacy='public').in_bulk(group_ids)
+    return [groups[group_id] for group_id in group_ids if group_id in groups]
+
+
+def invalidate_recommendations(user_ids):
+    cache.delete_many([recommendations_key(user_id) for user_id in user_ids])
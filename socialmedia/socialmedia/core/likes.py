@@ -0,0 +1,149 @@
+# core/likes.py
+#
+# Resolve "has the viewer liked this post?" without loading every liker, and
+# buffer like_count updates so a viral post's counter is recounted once per
+# interval rather than once per click. Works for any model with a `likes`
+# M2M to User (Post and GroupPost).
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Value, BooleanField
+
+from .counters import refresh_like_counts
+
+logger = logging.getLogger(__name__)
+
+LIKE_BUFFER_FLUSH_INTERVAL = getattr(settings, 'LIKE_BUFFER_FLUSH_INTERVAL', 1.0)
+LIKE_BUFFER_MAX_PENDING = getattr(settings, 'LIKE_BUFFER_MAX_PENDING', 5000)
+
+
+def _likes_through(model):
+    field = model._meta.get_field('likes')
+    return field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+
+
+def annotate_liked(queryset, user):
+    """Annotate each row with ``liked``: whether ``user`` has liked it.
+
+    The whole page is resolved by one EXISTS subquery against the likes
+    table's (post, user) unique index.
+    """
+    if not user.is_authenticated:
+        return queryset.annotate(liked=Value(False, output_field=BooleanField()))
+
+    through, post_field, user_field = _likes_through(queryset.model)
+    return queryset.annotate(liked=Exists(
+        through.objects.filter(**{post_field: OuterRef('pk'), user_field: user.pk})
+    ))
+
+
+class LikeBuffer:
+    """Like toggles with buffered like_count updates.
+
+    A toggle writes the like row straight away (one DELETE, or one INSERT
+    when there was nothing to delete), so the user's next read sees it on
+    any worker and two quick toggles on different workers cancel out
+    instead of racing on stale state. What is buffered is the expensive
+    part: every LIKE_BUFFER_FLUSH_INTERVAL seconds like_count is recounted
+    once for each post touched since the last flush, however many toggles
+    it took, and overlay() adds the changes not yet counted to posts read
+    in the meantime. A flush takes the pending changes with it before it
+    recounts, so toggles made meanwhile start a new batch rather than being
+    netted against a count that may already include them. A failed recount
+    puts its changes back and is retried; an interval of 0 recounts on
+    every toggle.
+    """
+
+    def __init__(self, flush_interval=None, max_pending=None):
+        self.flush_interval = LIKE_BUFFER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_pending = LIKE_BUFFER_MAX_PENDING if max_pending is None else max_pending
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.timer = None
+        # (model, post_id) -> like_count change not yet recounted
+        self.deltas = defaultdict(int)
+        # The changes the running flush is recounting
+        self.in_flight = {}
+
+    def toggle(self, post, user):
+        """Flip ``user``'s like on ``post`` and return the new liked state."""
+        through, post_field, user_field = _likes_through(type(post))
+        row = {f'{post_field}_id': post.pk, f'{user_field}_id': user.pk}
+        with transaction.atomic():
+            unliked, _ = through.objects.filter(**row).delete()
+            if not unliked:
+                through.objects.bulk_create([through(**row)], ignore_conflicts=True)
+        liked = not unliked
+
+        with self.lock:
+            self.deltas[(type(post), post.pk)] += 1 if liked else -1
+            flush_now = self.flush_interval <= 0 or len(self.deltas) >= self.max_pending
+            if not flush_now:
+                self._schedule(self.flush_interval)
+
+        if flush_now:
+            self.flush()
+        return liked
+
+    def overlay(self, posts):
+        """Add like_count changes not yet recounted to already-fetched posts."""
+        with self.lock:
+            if not self.deltas and not self.in_flight:
+                return posts
+            for post in posts:
+                key = (type(post), post.pk)
+                post.like_count += self.deltas.get(key, 0) + self.in_flight.get(key, 0)
+        return posts
+
+    def _schedule(self, delay):
+        # Called with self.lock held
+        if self.timer is None:
+            self.timer = threading.Timer(delay, self._flush_from_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Timer threads get their own database connections
+            connections.close_all()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                batch, self.deltas = self.deltas, defaultdict(int)
+                self.in_flight = batch
+            if not batch:
+                return
+
+            touched = defaultdict(set)
+            for model, post_id in batch:
+                touched[model].add(post_id)
+            try:
+                for model, post_ids in touched.items():
+                    refresh_like_counts(model, post_ids)
+            except Exception:
+                logger.exception('Error recounting likes on %d posts; retrying', len(batch))
+                with self.lock:
+                    # Put the changes back, so reads stay right and the
+                    # same posts are recounted on the next attempt
+                    for key, delta in batch.items():
+                        self.deltas[key] += delta
+                    self.in_flight = {}
+                    self._schedule(max(self.flush_interval, 1.0))
+                return
+
+            with self.lock:
+                self.in_flight = {}
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.content_search import get_backend, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the post, group post and comment search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} documents ({get_backend().name} backend)'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.models import User
+from core.search_index import index_user
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user search index from the users table'
+
+    def handle(self, *args, **options):
+        count = 0
+        for user in User.objects.only('id', 'username', 'first_name', 'last_name', 'bio').iterator():
+            index_user(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} users'))
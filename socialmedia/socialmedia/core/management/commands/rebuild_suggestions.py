@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.suggestions import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute "People you may know" suggestions for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_all(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt suggestions for {count} users'))
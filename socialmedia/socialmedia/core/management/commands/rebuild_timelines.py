@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from core.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached home timelines from the posts and friends tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        count = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            rebuild_timeline(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} timelines'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like/comment counters and fix any that have drifted'
+
+    def handle(self, *args, **options):
+        for counter, fixed in reconcile_all().items():
+            self.stdout.write(f'{counter}: {fixed} rows repaired')
+        self.stdout.write(self.style.SUCCESS('Counters reconciled'))
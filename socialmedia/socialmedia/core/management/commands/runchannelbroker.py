@@ -0,0 +1,37 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.channel_layer import BrokerChannelLayer, ChannelBroker
+
+
+class Command(BaseCommand):
+    help = 'Run the channel broker that BrokerChannelLayer workers connect to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layer', default='default', help='CHANNEL_LAYERS alias to serve')
+        parser.add_argument('--address', help='host:port or unix:/path (defaults to the layer CONFIG)')
+
+    def handle(self, *args, **options):
+        layer_settings = getattr(settings, 'CHANNEL_LAYERS', {}).get(options['layer'])
+        if layer_settings is None:
+            raise CommandError(f"No channel layer named {options['layer']!r}")
+        if layer_settings.get('BACKEND') != 'core.channel_layer.BrokerChannelLayer':
+            raise CommandError(
+                f"Channel layer {options['layer']!r} does not use the broker; set CHANNEL_BROKER_ADDRESS"
+            )
+        client = BrokerChannelLayer(**layer_settings.get('CONFIG', {}))
+        address = options['address'] or client.address
+        broker = ChannelBroker(client.broker_layer(), token=client.token)
+
+        async def serve():
+            server = await broker.serve(address)
+            self.stdout.write(self.style.SUCCESS(f'Channel broker listening on {address}'))
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
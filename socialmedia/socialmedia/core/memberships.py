@@ -0,0 +1,27 @@
+# core/memberships.py
+#
+# Group membership checks. Membership gates private group pages, posting,
+# chat history and the chat sockets, so it is always answered by the
+# database rather than a per-process copy that another worker's removal
+# would leave stale: one EXISTS probe on the members table's (group, user)
+# unique index. Sockets and streams a removed member already has open are
+# closed by the member-removed events sent when the removal commits (see
+# group_members_changed in core/signals.py).
+from .models import Group, GroupCall
+
+
+def is_group_member(group_id, user_id):
+    if user_id is None:
+        return False
+    return Group.members.through.objects.filter(group_id=group_id, user_id=user_id).exists()
+
+
+def is_call_participant(call_id, user_id):
+    """Whether ``user_id`` may join ``call_id``: a member of the call's group."""
+    if user_id is None:
+        return False
+    return GroupCall.objects.filter(id=call_id, group__members=user_id).exists()
+
+
+def active_call_ids(group_ids):
+    return list(GroupCall.objects.filter(group_id__in=group_ids, ended_at__isnull=True).values_list('id', flat=True))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_post_image_post_video'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grouppost',
+            index=models.Index(fields=['group', '-created_at', '-id'], name='grouppost_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 19:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, fk_field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{fk_field: OuterRef('pk')})
+            .order_by()
+            .values(fk_field)
+            .annotate(total=Count('*'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    GroupPost = apps.get_model('core', 'GroupPost')
+    Comment = apps.get_model('core', 'Comment')
+
+    Post.objects.update(
+        like_count=count_of(Post.likes.through.objects, 'post_id'),
+        comment_count=count_of(Comment.objects, 'post_id'),
+    )
+    GroupPost.objects.update(
+        like_count=count_of(GroupPost.likes.through.objects, 'grouppost_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_post_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouppost',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2 on 2026-10-18 20:00
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# A frozen copy of core.search_index.user_postings as of this migration, so
+# later changes to the live tokenizer cannot change what this builds
+FIELD_WEIGHTS = {
+    'username': 4,
+    'first_name': 3,
+    'last_name': 3,
+    'bio': 1,
+}
+TRIGRAM_FIELDS = ('username', 'first_name', 'last_name')
+TERM_MAX_LENGTH = 50
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return [word[:TERM_MAX_LENGTH] for word in WORD_RE.findall(text.lower())]
+
+
+def user_postings(username, first_name, last_name, bio):
+    values = {'username': username, 'first_name': first_name, 'last_name': last_name, 'bio': bio}
+    postings = {}
+
+    def add(term, kind, weight):
+        key = (term, kind)
+        postings[key] = max(postings.get(key, 0), weight)
+
+    for field, weight in FIELD_WEIGHTS.items():
+        words = tokenize(values[field] or '')
+        if field == 'username' and values[field]:
+            words.append(values[field].lower()[:TERM_MAX_LENGTH])
+        for word in words:
+            add(word, 'w', weight)
+            if field in TRIGRAM_FIELDS:
+                for i in range(len(word) - 2):
+                    add(word[i:i + 3], 't', weight)
+    return postings
+
+
+def build_search_index(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    UserSearchTerm = apps.get_model('core', 'UserSearchTerm')
+    batch = []
+    for user in User.objects.only('id', 'username', 'first_name', 'last_name', 'bio').iterator():
+        for (term, kind), weight in user_postings(user.username, user.first_name, user.last_name, user.bio).items():
+            batch.append(UserSearchTerm(term=term, kind=kind, user_id=user.id, weight=weight))
+        if len(batch) >= 1000:
+            UserSearchTerm.objects.bulk_create(batch)
+            batch = []
+    UserSearchTerm.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_post_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=50)),
+                ('kind', models.CharField(choices=[('w', 'Word'), ('t', 'Trigram')], max_length=1)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Search Term',
+                'verbose_name_plural': 'User Search Terms',
+                'unique_together': {('term', 'kind', 'user')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 20:02
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    # Local SQLite databases get an FTS5 table; other databases use the
+    # ContentSearchTerm postings instead (see core/content_search.py)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS core_content_fts USING fts5(body, tokenize='unicode61')"
+        )
+    except OperationalError:
+        pass  # SQLite built without FTS5
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_content_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_user_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50)),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('grouppost', 'Group Post'), ('comment', 'Comment')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('frequency', models.PositiveSmallIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'Content Search Term',
+                'verbose_name_plural': 'Content Search Terms',
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='contentsearch_object_idx')],
+                'unique_together': {('term', 'kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_member_counts(apps, schema_editor):
+    Group = apps.get_model('core', 'Group')
+    Group.objects.update(member_count=Coalesce(
+        Subquery(
+            Group.members.through.objects.filter(group_id=OuterRef('pk'))
+            .order_by()
+            .values('group_id')
+            .annotate(total=Count('*'))
+            .values('total')
+        ),
+        0,
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_content_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_member_counts, migrations.RunPython.noop),
+    ]
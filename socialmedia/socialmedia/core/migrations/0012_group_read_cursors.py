@@ -0,0 +1,89 @@
+# Generated by Django 5.2 on 2026-10-18 21:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+BATCH_SIZE = 1000
+
+
+def cursors_from_read_by(apps, schema_editor):
+    """One cursor per membership, at the newest message the member had in
+    read_by (0 if they had read nothing)."""
+    Group = apps.get_model('core', 'Group')
+    GroupMessage = apps.get_model('core', 'GroupMessage')
+    GroupReadCursor = apps.get_model('core', 'GroupReadCursor')
+
+    last_read = {
+        (user_id, group_id): last
+        for user_id, group_id, last in (
+            GroupMessage.read_by.through.objects
+            .values_list('user_id', 'groupmessage__group_id')
+            .annotate(last=Max('groupmessage_id'))
+            .order_by()
+        )
+    }
+    batch = []
+    for group_id, user_id in Group.members.through.objects.values_list('group_id', 'user_id').iterator():
+        batch.append(GroupReadCursor(
+            user_id=user_id,
+            group_id=group_id,
+            last_read_id=last_read.get((user_id, group_id), 0),
+        ))
+        if len(batch) >= BATCH_SIZE:
+            GroupReadCursor.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    GroupReadCursor.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def read_by_from_cursors(apps, schema_editor):
+    GroupMessage = apps.get_model('core', 'GroupMessage')
+    GroupReadCursor = apps.get_model('core', 'GroupReadCursor')
+    ReadBy = GroupMessage.read_by.through
+
+    batch = []
+    for cursor in GroupReadCursor.objects.filter(last_read_id__gt=0).iterator():
+        message_ids = (
+            GroupMessage.objects
+            .filter(group_id=cursor.group_id, id__lte=cursor.last_read_id)
+            .values_list('id', flat=True)
+            .iterator()
+        )
+        for message_id in message_ids:
+            batch.append(ReadBy(groupmessage_id=message_id, user_id=cursor.user_id))
+            if len(batch) >= BATCH_SIZE:
+                ReadBy.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+    ReadBy.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_group_member_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='core.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Group Read Cursor',
+                'verbose_name_plural': 'Group Read Cursors',
+                'unique_together': {('user', 'group')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['group', 'id'], name='groupmessage_group_id_idx'),
+        ),
+        migrations.RunPython(cursors_from_read_by, read_by_from_cursors),
+    ]
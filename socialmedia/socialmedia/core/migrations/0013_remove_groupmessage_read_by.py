@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_group_read_cursors'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='groupmessage',
+            name='read_by',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_remove_groupmessage_read_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('posts', 'Posts'), ('groups', 'Groups')], max_length=10)),
+                ('bucket', models.BigIntegerField()),
+                ('key', models.BigIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Trending Count',
+                'verbose_name_plural': 'Trending Counts',
+                'unique_together': {('kind', 'bucket', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2 on 2026-10-18 21:02
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# A frozen copy of core.content_search's indexing as of this migration, so
+# later changes to the live tokenizer cannot change what this builds
+TERM_MAX_LENGTH = 50
+WORD_RE = re.compile(r'[^\W_]+')
+FTS_TABLE = 'core_content_fts'
+MODELS = {
+    'post': 'Post',
+    'grouppost': 'GroupPost',
+    'comment': 'Comment',
+}
+KIND_CODES = {
+    'post': 1,
+    'grouppost': 2,
+    'comment': 3,
+}
+BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return [word[:TERM_MAX_LENGTH] for word in WORD_RE.findall(text.lower())]
+
+
+def documents(apps):
+    for kind, model_name in MODELS.items():
+        model = apps.get_model('core', model_name)
+        for object_id, content in model.objects.values_list('id', 'content').iterator(chunk_size=BATCH_SIZE):
+            yield kind, object_id, content
+
+
+def backfill_content_index(apps, schema_editor):
+    # 0010 created the index empty, and only content saved since then was
+    # indexed. Rebuild it the way `manage.py rebuild_content_index` does.
+    connection = schema_editor.connection
+    backend = getattr(settings, 'CONTENT_SEARCH_BACKEND', None)
+    if backend is None:
+        backend = 'fts5' if FTS_TABLE in connection.introspection.table_names() else 'postings'
+
+    if backend == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for kind, object_id, content in documents(apps):
+                batch.append((object_id * 4 + KIND_CODES[kind], content))
+                if len(batch) >= BATCH_SIZE:
+                    cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, body) VALUES (%s, %s)', batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, body) VALUES (%s, %s)', batch)
+        return
+
+    ContentSearchTerm = apps.get_model('core', 'ContentSearchTerm')
+    ContentSearchTerm.objects.all().delete()
+    batch = []
+    for kind, object_id, content in documents(apps):
+        for term, frequency in Counter(tokenize(content)).items():
+            batch.append(ContentSearchTerm(term=term, kind=kind, object_id=object_id, frequency=min(frequency, 32767)))
+        if len(batch) >= BATCH_SIZE:
+            ContentSearchTerm.objects.bulk_create(batch)
+            batch = []
+    ContentSearchTerm.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_trending_counts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contentsearchterm',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.RunPython(backfill_content_index, migrations.RunPython.noop),
+    ]
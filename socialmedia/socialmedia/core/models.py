@@ -118,11 +118,19 @@ class Post(models.Model):
         related_name='liked_posts', 
         blank=True
     )
+    # Denormalized counters, kept in step with likes/comments by the views
+    # and signals; `manage.py reconcile_counters` repairs any drift.
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_id_idx'),
+        ]
     
     def __str__(self):
         return f"Post by {self.user.username} at {self.created_at}"
@@ -217,6 +225,7 @@ class Group(models.Model):
         choices=PRIVACY_CHOICES, 
         default='public'
     )
+    member_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -267,11 +276,15 @@ class GroupPost(models.Model):
         related_name='liked_group_posts', 
         blank=True
     )
+    like_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Group Post'
         verbose_name_plural = 'Group Posts'
+        indexes = [
+            models.Index(fields=['group', '-created_at', '-id'], name='grouppost_group_created_idx'),
+        ]
 
     def __str__(self):
         return f"Post in {self.group.name} by {self.user.username}"
@@ -285,20 +298,41 @@ class GroupMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(default=timezone.now)
-    read_by = models.ManyToManyField(
-        User, 
-        related_name='read_messages', 
-        blank=True
-    )
 
     class Meta:
         ordering = ['timestamp']
         verbose_name = 'Group Message'
         verbose_name_plural = 'Group Messages'
+        indexes = [
+            models.Index(fields=['group', 'id'], name='groupmessage_group_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} in {self.group.name}: {self.content[:20]}..."
 
+class GroupReadCursor(models.Model):
+    """How far a member has read a group's chat (see core/read_cursors.py)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='read_cursors'
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='read_cursors'
+    )
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'group')
+        verbose_name = 'Group Read Cursor'
+        verbose_name_plural = 'Group Read Cursors'
+
+    def __str__(self):
+        return f"{self.user_id} read group {self.group_id} up to {self.last_read_id}"
+
 class GroupCall(models.Model):
     CALL_TYPE_CHOICES = (
         ('video', 'Video Call'),
@@ -394,4 +428,76 @@ class Notification(models.Model):
         return f"{self.get_notification_type_display()} for {self.recipient.username}"
     
     
-    
\ No newline at end of file
+
+class UserSearchTerm(models.Model):
+    """One posting of the user search index (see core/search_index.py)."""
+    WORD = 'w'
+    TRIGRAM = 't'
+    KIND_CHOICES = [
+        (WORD, 'Word'),
+        (TRIGRAM, 'Trigram'),
+    ]
+
+    term = models.CharField(max_length=50, db_index=True)
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='search_terms'
+    )
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('term', 'kind', 'user')
+        verbose_name = 'User Search Term'
+        verbose_name_plural = 'User Search Terms'
+
+    def __str__(self):
+        return f"{self.term} ({self.get_kind_display()}) -> {self.user_id}"
+
+
+class ContentSearchTerm(models.Model):
+    """One posting of the content search index (see core/content_search.py)."""
+    KIND_CHOICES = [
+        ('post', 'Post'),
+        ('grouppost', 'Group Post'),
+        ('comment', 'Comment'),
+    ]
+
+    term = models.CharField(max_length=50)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Post, GroupPost and Comment have BigAutoField keys
+    object_id = models.PositiveBigIntegerField()
+    frequency = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('term', 'kind', 'object_id')
+        indexes = [
+            models.Index(fields=['kind', 'object_id'], name='contentsearch_object_idx'),
+        ]
+        verbose_name = 'Content Search Term'
+        verbose_name_plural = 'Content Search Terms'
+
+    def __str__(self):
+        return f"{self.term} -> {self.kind} {self.object_id}"
+
+
+class TrendingCount(models.Model):
+    """Events for one post or group in one time bucket (see core/trending.py)."""
+    KIND_CHOICES = [
+        ('posts', 'Posts'),
+        ('groups', 'Groups'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    bucket = models.BigIntegerField()
+    key = models.BigIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('kind', 'bucket', 'key')
+        verbose_name = 'Trending Count'
+        verbose_name_plural = 'Trending Counts'
+
+    def __str__(self):
+        return f"{self.kind} {self.key} @ {self.bucket}: {self.count}"
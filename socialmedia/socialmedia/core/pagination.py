@@ -0,0 +1,100 @@
+# core/pagination.py
+#
+# Keyset ("cursor") pagination on (created_at, id) for Post and GroupPost
+# lists. Unlike OFFSET pagination every page costs the same, because the
+# cursor is turned into a WHERE clause the (created_at, id) ordering can seek
+# to directly instead of counting past all the earlier rows.
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+FEED_PAGE_SIZE = getattr(settings, 'FEED_PAGE_SIZE', 20)
+FEED_MAX_PAGE_SIZE = getattr(settings, 'FEED_MAX_PAGE_SIZE', 100)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj):
+    return encode_keyset(obj.created_at, obj.id)
+
+
+def encode_keyset(created_at, obj_id):
+    raw = f'{created_at.isoformat()}|{obj_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, obj_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(obj_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}')
+
+
+def get_page_size(request):
+    try:
+        page_size = int(request.GET.get('page_size', FEED_PAGE_SIZE))
+    except ValueError:
+        page_size = FEED_PAGE_SIZE
+    return max(1, min(page_size, FEED_MAX_PAGE_SIZE))
+
+
+def after_cursor(queryset, cursor):
+    """Order ``queryset`` newest first, starting just after ``cursor``."""
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, obj_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) |
+            Q(created_at=created_at, id__lt=obj_id)
+        )
+    return queryset
+
+
+def paginate(queryset, cursor=None, page_size=FEED_PAGE_SIZE):
+    """Return one page of ``queryset`` newest first and the cursor for the next."""
+    queryset = after_cursor(queryset, cursor)
+
+    # Fetch one extra row to know whether there is a next page
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1])
+    return items, next_cursor
+
+
+def paginate_request(request, queryset):
+    """Paginate using the ``cursor`` and ``page_size`` query parameters.
+
+    A malformed cursor falls back to the first page.
+    """
+    try:
+        return paginate(queryset, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        return paginate(queryset, None, get_page_size(request))
+
+
+def paginate_ids(ids, cursor=None, page_size=FEED_PAGE_SIZE):
+    """Page through a precomputed, already ordered id list.
+
+    Used for ranked feeds where (created_at, id) is not the sort order. The
+    cursor is the offset into the list, which is a plain slice.
+    """
+    offset = 0
+    if cursor:
+        try:
+            offset = int(cursor)
+        except ValueError:
+            raise InvalidCursor(f'Invalid cursor: {cursor!r}')
+        if offset < 0:
+            raise InvalidCursor(f'Invalid cursor: {cursor!r}')
+
+    page = ids[offset:offset + page_size]
+    next_cursor = str(offset + page_size) if offset + page_size < len(ids) else None
+    return page, next_cursor
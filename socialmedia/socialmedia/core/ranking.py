@@ -0,0 +1,127 @@
+# core/ranking.py
+#
+# Engagement-ranked "For You" feed. Recent posts are scored on recency
+# decay, like/comment velocity and the viewer's affinity for the author
+# (friendship and how often they have liked the author before). The ranked
+# id list is cached per user for a short time so serving a page is just a
+# slice of that list.
+#
+# Each ranking is kept as a snapshot under its own id, and the feed cursor
+# carries that id next to the offset. A viewer paging down stays on the
+# ranking their first page came from even after FOR_YOU_CACHE_TIMEOUT has
+# passed and new visits get a fresh one, so pages never repeat or skip
+# posts. Snapshots are kept for FOR_YOU_SNAPSHOT_TIMEOUT; a cursor that
+# outlives its snapshot continues at the same offset in the current
+# ranking.
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Post, User
+from .pagination import FEED_PAGE_SIZE, InvalidCursor, paginate_ids
+
+FOR_YOU_WINDOW = getattr(settings, 'FOR_YOU_WINDOW', timedelta(days=1))
+FOR_YOU_MAX_CANDIDATES = getattr(settings, 'FOR_YOU_MAX_CANDIDATES', 1000)
+FOR_YOU_BATCH_SIZE = getattr(settings, 'FOR_YOU_BATCH_SIZE', 256)
+FOR_YOU_CACHE_TIMEOUT = getattr(settings, 'FOR_YOU_CACHE_TIMEOUT', 120)
+FOR_YOU_SNAPSHOT_TIMEOUT = getattr(settings, 'FOR_YOU_SNAPSHOT_TIMEOUT', 30 * 60)
+
+# Scoring knobs
+HALF_LIFE_HOURS = 6.0
+COMMENT_WEIGHT = 2.0
+VELOCITY_WEIGHT = 1.0
+FRIEND_AFFINITY = 1.0
+LIKED_AUTHOR_AFFINITY = 0.5
+
+
+def for_you_key(user_id):
+    return f'for_you:{user_id}'
+
+
+def snapshot_key(user_id, snapshot):
+    return f'for_you:{user_id}:{snapshot}'
+
+
+def author_affinity(user):
+    """Map author id -> affinity score for ``user``."""
+    affinity = {}
+    for friend_id in User.objects.filter(id=user.id).values_list('friends__id', flat=True):
+        if friend_id is not None:
+            affinity[friend_id] = FRIEND_AFFINITY
+
+    liked_authors = (Post.likes.through.objects
+                     .filter(user_id=user.id)
+                     .values('post__user_id')
+                     .annotate(total=Count('*')))
+    for row in liked_authors:
+        author_id = row['post__user_id']
+        affinity[author_id] = affinity.get(author_id, 0.0) + LIKED_AUTHOR_AFFINITY * math.log1p(row['total'])
+    return affinity
+
+
+def score_batch(authors, created, likes, comments, now, affinity):
+    """Score one batch of candidates given as parallel feature columns."""
+    ages = [max((now - created_at).total_seconds() / 3600.0, 0.0) for created_at in created]
+    decay = [0.5 ** (age / HALF_LIFE_HOURS) for age in ages]
+    velocity = [
+        (like_count + COMMENT_WEIGHT * comment_count) / (age + 2.0)
+        for like_count, comment_count, age in zip(likes, comments, ages)
+    ]
+    return [
+        d * (1.0 + VELOCITY_WEIGHT * v) * (1.0 + affinity.get(author_id, 0.0))
+        for d, v, author_id in zip(decay, velocity, authors)
+    ]
+
+
+def rank_for_you(user):
+    now = timezone.now()
+    candidates = list(
+        Post.objects.filter(created_at__gte=now - FOR_YOU_WINDOW)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'user_id', 'created_at', 'like_count', 'comment_count')[:FOR_YOU_MAX_CANDIDATES]
+    )
+    affinity = author_affinity(user)
+
+    scored = []
+    for start in range(0, len(candidates), FOR_YOU_BATCH_SIZE):
+        batch = candidates[start:start + FOR_YOU_BATCH_SIZE]
+        ids, authors, created, likes, comments = zip(*batch)
+        scored.extend(zip(score_batch(authors, created, likes, comments, now, affinity), ids))
+
+    scored.sort(key=lambda item: (-item[0], -item[1]))
+    post_ids = [post_id for _, post_id in scored]
+    snapshot = format(int(time.time() * 1000), 'x')
+    cache.set(snapshot_key(user.id, snapshot), post_ids, FOR_YOU_SNAPSHOT_TIMEOUT)
+    cache.set(for_you_key(user.id), snapshot, FOR_YOU_CACHE_TIMEOUT)
+    return snapshot, post_ids
+
+
+def get_for_you(user, snapshot=None):
+    """Return (snapshot id, ranked post ids): the ranking ``snapshot`` if it
+    is still kept, else the user's current one."""
+    for candidate in (snapshot, cache.get(for_you_key(user.id))):
+        if candidate:
+            post_ids = cache.get(snapshot_key(user.id, candidate))
+            if post_ids is not None:
+                return candidate, post_ids
+    return rank_for_you(user)
+
+
+def paginate_for_you(user, cursor=None, page_size=FEED_PAGE_SIZE):
+    """Return one page of the user's ranked post ids and the next cursor.
+
+    Cursors are "<snapshot id>.<offset>".
+    """
+    snapshot = offset = None
+    if cursor:
+        snapshot, dot, offset = cursor.partition('.')
+        if not dot:
+            raise InvalidCursor(f'Invalid cursor: {cursor!r}')
+    snapshot, post_ids = get_for_you(user, snapshot)
+    page, next_offset = paginate_ids(post_ids, offset, page_size)
+    return page, next_offset and f'{snapshot}.{next_offset}'
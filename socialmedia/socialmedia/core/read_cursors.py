@@ -0,0 +1,70 @@
+# core/read_cursors.py
+#
+# Per-member read position in each group chat. A member's GroupReadCursor
+# holds the id of the last message they have read, so marking a chat read is
+# one UPDATE however many messages arrived, and "unread" is every message
+# from someone else with a larger id. Message ids come from the table's
+# sequence and grow with time (see core/chat_writer.py), which is what makes
+# a single id a valid cursor.
+#
+# Every membership has a cursor: joining a group starts one at the group's
+# newest message, leaving drops it. That keeps unread_counts() a plain join
+# over the user's cursors.
+from django.db.models import Count, F, FilteredRelation, Max, Q
+from django.utils import timezone
+
+from .models import GroupMessage, GroupReadCursor
+
+
+def mark_read(user_id, group_id, message_id):
+    """Move the user's cursor forward to ``message_id``; never backwards."""
+    if not message_id:
+        return
+    updated = (
+        GroupReadCursor.objects
+        .filter(user_id=user_id, group_id=group_id, last_read_id__lt=message_id)
+        .update(last_read_id=message_id, updated_at=timezone.now())
+    )
+    if not updated:
+        # Either already past message_id or missing; only the latter inserts
+        GroupReadCursor.objects.bulk_create(
+            [GroupReadCursor(user_id=user_id, group_id=group_id, last_read_id=message_id)],
+            ignore_conflicts=True,
+        )
+
+
+def unread_counts(user_id):
+    """Return {group_id: unread message count} for all of the user's groups."""
+    # The cursor condition goes in the join, so each group's (group, id)
+    # index range past the cursor is all that gets read
+    return dict(
+        GroupReadCursor.objects
+        .filter(user_id=user_id)
+        .annotate(unread_messages=FilteredRelation(
+            'group__messages',
+            condition=Q(group__messages__id__gt=F('last_read_id')),
+        ))
+        .values_list('group_id')
+        .annotate(unread=Count('unread_messages', filter=~Q(unread_messages__sender_id=user_id)))
+        .order_by()
+    )
+
+
+def start_cursors(group_ids, user_ids):
+    """Start new members at each group's newest message."""
+    newest = dict(
+        GroupMessage.objects.filter(group_id__in=group_ids)
+        .values_list('group_id').annotate(last=Max('id')).order_by()
+    )
+    GroupReadCursor.objects.bulk_create(
+        [
+            GroupReadCursor(user_id=user_id, group_id=group_id, last_read_id=newest.get(group_id, 0))
+            for group_id in group_ids
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def drop_cursors(group_ids, user_ids):
+    GroupReadCursor.objects.filter(group_id__in=group_ids, user_id__in=user_ids).delete()
@@ -0,0 +1,148 @@
+# core/search_index.py
+#
+# Inverted index for user search. Every user gets one posting per distinct
+# word of their username, names and bio, and one per trigram of their
+# username and names, stored in UserSearchTerm with an index on the term.
+# A query word is looked up by prefix on the word postings (an index range
+# scan, not a table scan) and, when that finds too little, by its trigrams,
+# which also catches matches inside a word and small typos. Results are
+# ordered by a weighted score: exact words beat prefixes, which beat
+# trigram overlap, and username hits beat name hits, which beat bio hits.
+import math
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, When
+
+from .models import UserSearchTerm
+
+SEARCH_MAX_QUERY_TERMS = getattr(settings, 'SEARCH_MAX_QUERY_TERMS', 5)
+SEARCH_TRIGRAM_MIN_SIMILARITY = getattr(settings, 'SEARCH_TRIGRAM_MIN_SIMILARITY', 0.5)
+# Shorter query words only match whole words: a one-letter prefix would
+# range-scan a large slice of the index
+SEARCH_MIN_PREFIX_LENGTH = getattr(settings, 'SEARCH_MIN_PREFIX_LENGTH', 2)
+
+FIELD_WEIGHTS = {
+    'username': 4,
+    'first_name': 3,
+    'last_name': 3,
+    'bio': 1,
+}
+# Bios are long and free-form; their trigrams would dominate the index
+TRIGRAM_FIELDS = ('username', 'first_name', 'last_name')
+INDEXED_FIELDS = frozenset(FIELD_WEIGHTS)
+
+EXACT_BONUS = 3
+PREFIX_BONUS = 2
+
+TERM_MAX_LENGTH = UserSearchTerm._meta.get_field('term').max_length
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return [word[:TERM_MAX_LENGTH] for word in WORD_RE.findall(text.lower())]
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def user_postings(username, first_name, last_name, bio):
+    """Return {(term, kind): weight} for one user's searchable fields."""
+    values = {'username': username, 'first_name': first_name, 'last_name': last_name, 'bio': bio}
+    postings = {}
+
+    def add(term, kind, weight):
+        key = (term, kind)
+        postings[key] = max(postings.get(key, 0), weight)
+
+    for field, weight in FIELD_WEIGHTS.items():
+        words = tokenize(values[field] or '')
+        if field == 'username' and values[field]:
+            # "jane_doe" is findable as "jane_doe", "jane" and "doe"
+            words.append(values[field].lower()[:TERM_MAX_LENGTH])
+        for word in words:
+            add(word, UserSearchTerm.WORD, weight)
+            if field in TRIGRAM_FIELDS:
+                for trigram in trigrams(word):
+                    add(trigram, UserSearchTerm.TRIGRAM, weight)
+    return postings
+
+
+def index_user(user):
+    """Bring ``user``'s postings in line with their current fields.
+
+    Only the difference is written, so saves that do not touch a searchable
+    field (last_seen updates, password changes) cost a single read.
+    """
+    wanted = user_postings(user.username, user.first_name, user.last_name, user.bio)
+    existing = {
+        (term, kind): (posting_id, weight)
+        for posting_id, term, kind, weight in
+        UserSearchTerm.objects.filter(user=user).values_list('id', 'term', 'kind', 'weight')
+    }
+    stale = [posting_id for key, (posting_id, weight) in existing.items() if wanted.get(key) != weight]
+    new = [
+        UserSearchTerm(term=term, kind=kind, user=user, weight=weight)
+        for (term, kind), weight in wanted.items()
+        if existing.get((term, kind), (None, None))[1] != weight
+    ]
+    if not stale and not new:
+        return
+    with transaction.atomic():
+        if stale:
+            UserSearchTerm.objects.filter(id__in=stale).delete()
+        UserSearchTerm.objects.bulk_create(new)
+
+
+def _ranked(condition, score, exclude_id, limit, having=None):
+    postings = UserSearchTerm.objects.filter(condition)
+    if exclude_id is not None:
+        postings = postings.exclude(user_id=exclude_id)
+    rows = postings.values('user_id').annotate(score=Sum(score))
+    if having is not None:
+        rows = having(rows)
+    return [row['user_id'] for row in rows.order_by('-score', 'user_id')[:limit]]
+
+
+def search_user_ids(query, exclude_id=None, limit=200):
+    """Return up to ``limit`` user ids matching ``query``, best first."""
+    words = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_QUERY_TERMS]
+    if not words:
+        return []
+
+    prefix_condition = Q()
+    prefix_whens = []
+    prefixes = [word for word in words if len(word) >= SEARCH_MIN_PREFIX_LENGTH]
+    for word in words:
+        if word in prefixes:
+            prefix_condition |= Q(kind=UserSearchTerm.WORD, term__startswith=word)
+        else:
+            prefix_condition |= Q(kind=UserSearchTerm.WORD, term=word)
+        prefix_whens.append(When(kind=UserSearchTerm.WORD, term=word, then=F('weight') * EXACT_BONUS))
+    for word in prefixes:
+        prefix_whens.append(When(
+            kind=UserSearchTerm.WORD, term__startswith=word, then=F('weight') * PREFIX_BONUS
+        ))
+    prefix_score = Case(*prefix_whens, default=0, output_field=IntegerField())
+
+    user_ids = _ranked(prefix_condition, prefix_score, exclude_id, limit)
+    query_trigrams = set().union(*(trigrams(word) for word in words))
+    if len(user_ids) >= limit or not query_trigrams:
+        return user_ids
+
+    # Too few prefix hits: also rank users sharing enough trigrams with the
+    # query, after the prefix matches
+    min_hits = math.ceil(len(query_trigrams) * SEARCH_TRIGRAM_MIN_SIMILARITY)
+    trigram_condition = Q(kind=UserSearchTerm.TRIGRAM, term__in=query_trigrams)
+    fuzzy_ids = _ranked(
+        trigram_condition,
+        F('weight'),
+        exclude_id,
+        limit,
+        having=lambda rows: rows.annotate(hits=Count('id')).filter(hits__gte=min_hits),
+    )
+    seen = set(user_ids)
+    user_ids.extend(user_id for user_id in fuzzy_ids if user_id not in seen)
+    return user_ids[:limit]
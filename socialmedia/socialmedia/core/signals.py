@@ -0,0 +1,216 @@
+# core/signals.py
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Comment, Group, GroupPost, Notification, Post, User
+from . import suggestions, timeline
+from .group_recommendations import invalidate_recommendations
+from .counters import adjust_counter
+from .trending import trending
+from .fragments import invalidate_post_fragments
+from .friend_graph import friend_graph
+from .memberships import active_call_ids
+from .read_cursors import drop_cursors, start_cursors
+from .search_index import INDEXED_FIELDS, index_user
+from .typeahead import GROUP, USER, typeahead
+from .content_search import index_document, remove_document
+from .consumers import user_group_name
+from .chat_stream import call_member_removed_event, chat_group_name, member_removed_event
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.push_post(instance)
+    index_document('post', instance)
+
+
+@receiver(post_delete, sender=Post)
+def cleanup_deleted_post(sender, instance, **kwargs):
+    timeline.remove_post(instance)
+    invalidate_post_fragments(instance)
+    remove_document('post', instance)
+
+
+@receiver(post_save, sender=User)
+def update_search_index(sender, instance, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and not INDEXED_FIELDS & set(update_fields)):
+        return
+    index_user(instance)
+
+
+@receiver(post_save, sender=User)
+def update_typeahead_user(sender, instance, **kwargs):
+    if instance.is_active:
+        typeahead.put(USER, instance.pk, instance.username)
+    else:
+        typeahead.discard(USER, instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def remove_typeahead_user(sender, instance, **kwargs):
+    typeahead.discard(USER, instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def update_typeahead_group(sender, instance, **kwargs):
+    if instance.privacy == 'public':
+        typeahead.put(GROUP, instance.pk, instance.name)
+    else:
+        typeahead.discard(GROUP, instance.pk)
+
+
+@receiver(post_delete, sender=Group)
+def remove_typeahead_group(sender, instance, **kwargs):
+    typeahead.discard(GROUP, instance.pk)
+
+
+def remember_removed_ids(instance, sender, related, pk_set):
+    # remove() reports every id it was asked to remove, related or not, so
+    # pre_remove notes which of them really are and post_remove uses those
+    removing = instance.__dict__.setdefault('_m2m_removing', {})
+    removing[sender] = set(related.filter(pk__in=pk_set).values_list('pk', flat=True))
+
+
+def removed_ids(instance, sender):
+    return instance.__dict__.get('_m2m_removing', {}).pop(sender, set())
+
+
+@receiver(m2m_changed, sender=User.friends.through)
+def friends_changed(sender, instance, action, pk_set, **kwargs):
+    # Adding or removing a friend changes which posts belong on both users'
+    # timelines, so drop them and let the next read rebuild them.
+    if action == 'pre_remove':
+        remember_removed_ids(instance, sender, instance.friends, pk_set)
+        return
+    if action == 'post_remove':
+        pk_set = removed_ids(instance, sender)
+    if action in ('post_add', 'post_remove') and pk_set:
+        timeline.invalidate_timelines({instance.pk} | pk_set)
+        update_edge = friend_graph.add_edge if action == 'post_add' else friend_graph.remove_edge
+        delta = 1 if action == 'post_add' else -1
+        for friend_id in pk_set:
+            update_edge(instance.pk, friend_id)
+            typeahead.adjust_weight(USER, instance.pk, delta)
+            typeahead.adjust_weight(USER, friend_id, delta)
+        suggestions.invalidate_suggestions(suggestions.rows_touched_by_friendship({instance.pk} | pk_set))
+        invalidate_recommendations({instance.pk} | pk_set)
+    elif action == 'pre_clear':
+        friend_ids = set(instance.friends.values_list('id', flat=True))
+        timeline.invalidate_timelines({instance.pk} | friend_ids)
+        suggestions.invalidate_suggestions(suggestions.rows_touched_by_friendship({instance.pk} | friend_ids))
+        invalidate_recommendations({instance.pk} | friend_ids)
+        friend_graph.forget({instance.pk} | friend_ids)
+        typeahead.adjust_weight(USER, instance.pk, -len(friend_ids))
+        for friend_id in friend_ids:
+            typeahead.adjust_weight(USER, friend_id, -1)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Joining or leaving a group changes its member count, the member's chat
+    # read cursor and the shared-group counts between the member and
+    # everyone else in it.
+    if action == 'pre_remove':
+        remember_removed_ids(instance, sender, instance.joined_groups if reverse else instance.members, pk_set)
+        return
+    if action == 'post_remove':
+        pk_set = removed_ids(instance, sender)
+    if action in ('post_add', 'post_remove', 'pre_clear'):
+        if action == 'pre_clear':
+            pk_set = set(
+                instance.joined_groups.values_list('id', flat=True) if reverse
+                else instance.members.values_list('id', flat=True)
+            )
+        if reverse:
+            group_ids, user_ids = set(pk_set or ()), {instance.pk}
+        else:
+            group_ids, user_ids = {instance.pk}, set(pk_set or ())
+        if not group_ids or not user_ids:
+            return
+
+        delta = 1 if action == 'post_add' else -1
+        for group_id in group_ids:
+            adjust_counter(Group, group_id, 'member_count', delta * len(user_ids))
+            typeahead.adjust_weight(GROUP, group_id, delta * len(user_ids))
+        if action == 'post_add':
+            start_cursors(group_ids, user_ids)
+        else:
+            drop_cursors(group_ids, user_ids)
+            transaction.on_commit(lambda: revoke_chat_access(group_ids, user_ids))
+        suggestions.invalidate_suggestions(suggestions.rows_touched_by_membership(group_ids, user_ids))
+        # Group recommendations count friends' memberships too
+        invalidate_recommendations(suggestions.rows_touched_by_friendship(user_ids))
+
+
+def revoke_chat_access(group_ids, user_ids):
+    # Sockets and streams check membership when they open; tell the ones
+    # already open, on whichever worker holds them, to let these users go
+    send = async_to_sync(get_channel_layer().group_send)
+    try:
+        for group_id in group_ids:
+            send(chat_group_name(group_id), member_removed_event(group_id, user_ids))
+        for call_id in active_call_ids(group_ids):
+            send(f'call_{call_id}', call_member_removed_event(call_id, user_ids))
+    except Exception as e:
+        logger.error(f"Error revoking chat access: {str(e)}")
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter(Post, instance.post_id, 'comment_count', 1)
+        trending.record('posts', instance.post_id)
+    index_document('comment', instance)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    adjust_counter(Post, instance.post_id, 'comment_count', -1)
+    remove_document('comment', instance)
+
+
+@receiver(post_save, sender=GroupPost)
+def count_group_post(sender, instance, created, **kwargs):
+    if created:
+        trending.record('groups', instance.group_id)
+    index_document('grouppost', instance)
+
+
+@receiver(post_delete, sender=GroupPost)
+def cleanup_deleted_group_post(sender, instance, **kwargs):
+    remove_document('grouppost', instance)
+
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    # Delivered over the recipient's user socket, if one is open
+    if not created:
+        return
+    event = {
+        'type': 'notification',
+        'notification': {
+            'notification_id': instance.id,
+            'notification_type': instance.notification_type,
+            'message': instance.message,
+            'sender_id': instance.sender_id,
+            'group_id': instance.group_id,
+            'post_id': instance.post_id,
+            'created_at': instance.created_at.isoformat(),
+        },
+    }
+
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(user_group_name(instance.recipient_id), event)
+        except Exception as e:
+            logger.error(f"Error pushing notification: {str(e)}")
+
+    transaction.on_commit(send)
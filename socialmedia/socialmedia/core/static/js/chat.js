@@ -9,6 +9,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const callOptions = document.querySelectorAll('.call-option');
     
     let lastMessageId = LAST_MESSAGE_ID;
+    let onlineMembers = new Map();
     let isTyping = false;
     let typingTimer;
     
@@ -23,7 +24,6 @@ document.addEventListener('DOMContentLoaded', function() {
     // WebSocket event handlers
     socket.onopen = function(e) {
         console.log('WebSocket connection established');
-        checkForNewMessages();
     };
     
     socket.onmessage = function(e) {
@@ -36,7 +36,7 @@ document.addEventListener('DOMContentLoaded', function() {
             handleTypingIndicator(data);
         }
         else if (data.type === 'presence') {
-            updateOnlineMembers(data.online_members);
+            applyPresence(data);
         }
         else if (data.type === 'call') {
             handleCallEvent(data);
@@ -104,8 +104,27 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Periodically check for new messages (fallback if WebSocket fails)
-    setInterval(checkForNewMessages, 10000);
+    // New messages and presence changes are pushed over Server-Sent Events.
+    // EventSource reconnects on its own and resumes after the last event id.
+    const stream = new EventSource(`/group/${GROUP_ID}/chat/stream/?last_id=${lastMessageId}`);
+    
+    stream.addEventListener('message', function(e) {
+        addMessage(JSON.parse(e.data));
+    });
+    
+    stream.addEventListener('presence', function(e) {
+        const data = JSON.parse(e.data);
+        if (data.online_members) {
+            updateOnlineMembers(data.online_members);
+        } else {
+            applyPresence(data);
+        }
+    });
+    
+    // Sent when this user leaves or is removed from the group
+    stream.addEventListener('removed', function() {
+        stream.close();
+    });
     
     function sendMessage() {
         const message = messageInput.value.trim();
@@ -136,6 +155,29 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        const messageElement = createMessageElement(messageData);
+        
+        // If it's our own message, replace the temporary one
+        if (messageData.is_self && !String(messageData.id).startsWith('temp-')) {
+            const tempMessage = document.querySelector('[data-message-id^="temp-"]');
+            if (tempMessage) {
+                tempMessage.replaceWith(messageElement);
+            } else {
+                chatMessages.prepend(messageElement);
+            }
+        } else {
+            chatMessages.prepend(messageElement);
+        }
+        
+        scrollToBottom();
+        
+        // Update last message ID
+        if (!String(messageData.id).startsWith('temp-') && messageData.id > lastMessageId) {
+            lastMessageId = messageData.id;
+        }
+    }
+    
+    function createMessageElement(messageData) {
         const messageElement = document.createElement('div');
         messageElement.className = `message ${messageData.is_self ? 'sent' : 'received'}`;
         messageElement.dataset.messageId = messageData.id;
@@ -161,48 +203,51 @@ document.addEventListener('DOMContentLoaded', function() {
                 </div>
             </div>
         `;
-        
-        // If it's our own message, replace the temporary one
-        if (messageData.is_self && messageData.id.startsWith('temp-')) {
-            const tempMessage = document.querySelector(`[data-message-id="${messageData.id}"]`);
-            if (tempMessage) {
-                tempMessage.replaceWith(messageElement);
-            } else {
-                chatMessages.prepend(messageElement);
-            }
-        } else {
-            chatMessages.prepend(messageElement);
-        }
-        
-        scrollToBottom();
-        
-        // Update last message ID
-        if (!messageData.id.startsWith('temp-') && messageData.id > lastMessageId) {
-            lastMessageId = messageData.id;
-        }
+        return messageElement;
     }
     
-    function checkForNewMessages() {
-        fetch(`/group/${GROUP_ID}/chat/api/?last_id=${lastMessageId}`)
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    data.messages.reverse().forEach(msg => {
-                        // Only add messages we don't already have
+    // Older history, a page at a time, keyed by the oldest message shown
+    const loadOlderButton = document.getElementById('load-older');
+    if (loadOlderButton) {
+        loadOlderButton.addEventListener('click', function() {
+            fetch(`${loadOlderButton.dataset.url}?before=${loadOlderButton.dataset.cursor}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status !== 'success') {
+                        return;
+                    }
+                    data.messages.forEach(msg => {
                         if (!document.querySelector(`[data-message-id="${msg.id}"]`)) {
-                            addMessage(msg);
+                            chatMessages.insertBefore(createMessageElement(msg), loadOlderButton);
                         }
                     });
-                    
-                    updateOnlineMembers(data.online_members);
-                }
-            });
+                    if (data.next_cursor) {
+                        loadOlderButton.dataset.cursor = data.next_cursor;
+                    } else {
+                        loadOlderButton.remove();
+                    }
+                });
+        });
+    }
+    
+    function updateOnlineMembers(members) {
+        onlineMembers = new Map(members.map(member => [member.id, member]));
+        renderOnlineCount();
+    }
+    
+    function applyPresence(data) {
+        if (data.online) {
+            onlineMembers.set(data.user_id, {id: data.user_id, username: data.username});
+        } else {
+            onlineMembers.delete(data.user_id);
+        }
+        renderOnlineCount();
     }
     
-    function updateOnlineMembers(onlineMembers) {
+    function renderOnlineCount() {
         const onlineCount = document.getElementById('online-members');
         if (onlineCount) {
-            onlineCount.textContent = onlineMembers.length;
+            onlineCount.textContent = onlineMembers.size;
         }
     }
     
@@ -64,4 +64,101 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     });
+    
+    // Toggle likes in place; the like endpoints answer with JSON counts
+    document.querySelectorAll('[data-like-toggle]').forEach(link => {
+        link.addEventListener('click', function(e) {
+            e.preventDefault();
+            fetch(this.href, {
+                method: 'POST',
+                headers: {'X-CSRFToken': getCookie('csrftoken')},
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status !== 'success') {
+                    return;
+                }
+                const count = this.querySelector('[data-like-count]');
+                if (count) {
+                    count.textContent = data.like_count;
+                }
+                const materialIcon = this.querySelector('.material-icons');
+                if (materialIcon) {
+                    materialIcon.textContent = data.liked ? 'favorite' : 'favorite_border';
+                }
+                const heartIcon = this.querySelector('.fa-heart');
+                if (heartIcon) {
+                    heartIcon.classList.toggle('fas', data.liked);
+                    heartIcon.classList.toggle('far', !data.liked);
+                    heartIcon.classList.toggle('text-danger', data.liked);
+                }
+            });
+        });
+    });
+    
+    // Autocomplete for the header search box
+    const typeaheadInput = document.querySelector('[data-typeahead-url]');
+    if (typeaheadInput) {
+        const suggestionList = document.createElement('ul');
+        suggestionList.className = 'typeahead-results';
+        typeaheadInput.parentNode.appendChild(suggestionList);
+        let typeaheadTimer = null;
+        let typeaheadRequest = 0;
+
+        typeaheadInput.addEventListener('input', function() {
+            clearTimeout(typeaheadTimer);
+            const query = this.value.trim();
+            if (!query) {
+                suggestionList.innerHTML = '';
+                return;
+            }
+            typeaheadTimer = setTimeout(() => {
+                const requestId = ++typeaheadRequest;
+                fetch(`${this.dataset.typeaheadUrl}?q=${encodeURIComponent(query)}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        // Ignore answers to queries the user has already typed past
+                        if (requestId !== typeaheadRequest || data.status !== 'success') {
+                            return;
+                        }
+                        suggestionList.innerHTML = '';
+                        data.users.forEach(user => addSuggestion(user.url, user.username, 'person'));
+                        data.groups.forEach(group => addSuggestion(group.url, group.name, 'groups'));
+                    });
+            }, 100);
+        });
+
+        typeaheadInput.addEventListener('blur', function() {
+            // Leave time for a click on a suggestion to land
+            setTimeout(() => { suggestionList.innerHTML = ''; }, 200);
+        });
+
+        function addSuggestion(url, label, icon) {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = url;
+            const iconSpan = document.createElement('span');
+            iconSpan.className = 'material-icons';
+            iconSpan.textContent = icon;
+            link.appendChild(iconSpan);
+            link.appendChild(document.createTextNode(label));
+            item.appendChild(link);
+            suggestionList.appendChild(item);
+        }
+    }
+    
+    function getCookie(name) {
+        let cookieValue = null;
+        if (document.cookie && document.cookie !== '') {
+            const cookies = document.cookie.split(';');
+            for (let i = 0; i < cookies.length; i++) {
+                const cookie = cookies[i].trim();
+                if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                    cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                    break;
+                }
+            }
+        }
+        return cookieValue;
+    }
 });
\ No newline at end of file
@@ -0,0 +1,148 @@
+# core/suggestions.py
+#
+# "People you may know". Candidates are friends of friends, scored by the
+# number of mutual friends and the number of groups shared with the user.
+# With F the friendship adjacency matrix and M the user x group membership
+# matrix, a user's row of F·F gives mutual-friend counts and their row of
+# M·Mᵀ gives shared-group counts. Both are sparse, so they are computed row
+# by row (Gustavson's method) over adjacency lists rather than as dense
+# matrices. Each user's ranked list is stored in the cache; when an edge
+# changes only the rows it touches are dropped and recomputed on next read.
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .friend_graph import friend_graph
+from .models import Group, User
+
+SUGGESTION_LIMIT = getattr(settings, 'SUGGESTION_LIMIT', 20)
+SUGGESTION_CACHE_TIMEOUT = getattr(settings, 'SUGGESTION_CACHE_TIMEOUT', 60 * 60 * 24)
+SUGGESTION_MUTUAL_WEIGHT = getattr(settings, 'SUGGESTION_MUTUAL_WEIGHT', 1.0)
+SUGGESTION_GROUP_WEIGHT = getattr(settings, 'SUGGESTION_GROUP_WEIGHT', 0.5)
+# Sharing a very large group says little about whether two people know each
+# other, and its M·Mᵀ block is dense, so such groups are left out.
+SUGGESTION_MAX_GROUP_SIZE = getattr(settings, 'SUGGESTION_MAX_GROUP_SIZE', 500)
+
+GroupMembers = Group.members.through
+
+
+def suggestions_key(user_id):
+    return f'suggestions:{user_id}'
+
+
+def rank_candidates(user_id, friend_ids, mutual_counts, shared_counts):
+    """Return the top [candidate_id, mutual, shared] rows for one user."""
+    excluded = set(friend_ids)
+    excluded.add(user_id)
+    scored = (
+        (
+            mutual * SUGGESTION_MUTUAL_WEIGHT + shared_counts.get(candidate_id, 0) * SUGGESTION_GROUP_WEIGHT,
+            mutual,
+            -candidate_id,
+        )
+        for candidate_id, mutual in mutual_counts.items()
+        if candidate_id not in excluded
+    )
+    return [
+        [-negative_id, mutual, shared_counts.get(-negative_id, 0)]
+        for _, mutual, negative_id in heapq.nlargest(SUGGESTION_LIMIT, scored)
+    ]
+
+
+def _small_group_ids(group_ids):
+    return [
+        row['group_id']
+        for row in GroupMembers.objects.filter(group_id__in=group_ids)
+        .values('group_id').annotate(size=Count('*')).filter(size__lte=SUGGESTION_MAX_GROUP_SIZE)
+    ]
+
+
+def compute_suggestions(user_id):
+    """Compute one user's row: friends of friends and their shared groups."""
+    friend_ids = friend_graph.friends_of(user_id)
+    mutual_counts = Counter()
+    for ids in friend_graph.load(list(friend_ids)).values():
+        mutual_counts.update(ids)
+
+    shared_counts = {}
+    if mutual_counts:
+        group_ids = _small_group_ids(GroupMembers.objects.filter(user_id=user_id).values('group_id'))
+        if group_ids:
+            shared_counts = dict(
+                GroupMembers.objects.filter(group_id__in=group_ids, user_id__in=list(mutual_counts))
+                .values_list('user_id').annotate(shared=Count('*')).order_by()
+            )
+    return rank_candidates(user_id, friend_ids, mutual_counts, shared_counts)
+
+
+def refresh_suggestions(user_id):
+    suggestions = compute_suggestions(user_id)
+    cache.set(suggestions_key(user_id), suggestions, SUGGESTION_CACHE_TIMEOUT)
+    return suggestions
+
+
+def get_suggestions(user):
+    suggestions = cache.get(suggestions_key(user.id))
+    if suggestions is None:
+        suggestions = refresh_suggestions(user.id)
+    return suggestions
+
+
+def invalidate_suggestions(user_ids):
+    cache.delete_many([suggestions_key(user_id) for user_id in user_ids])
+
+
+def rows_touched_by_friendship(user_ids):
+    # A new or removed edge u-v changes the rows of u and v, and of every
+    # friend of either of them (for whom the other is a friend of a friend).
+    touched = set(user_ids)
+    for ids in friend_graph.load(list(user_ids)).values():
+        touched.update(ids)
+    return touched
+
+
+def rows_touched_by_membership(group_ids, user_ids):
+    touched = set(user_ids)
+    touched.update(
+        GroupMembers.objects.filter(group_id__in=_small_group_ids(group_ids)).values_list('user_id', flat=True)
+    )
+    return touched
+
+
+def rebuild_all(batch_size=1000):
+    """Recompute every user's suggestions from the full edge lists."""
+    friends = defaultdict(list)
+    for user_id, friend_id in User.friends.through.objects.values_list('from_user_id', 'to_user_id').iterator():
+        friends[user_id].append(friend_id)
+
+    group_ids = _small_group_ids(Group.objects.values('id'))
+    groups_of = defaultdict(set)
+    for user_id, group_id in GroupMembers.objects.filter(group_id__in=group_ids).values_list('user_id', 'group_id').iterator():
+        groups_of[user_id].add(group_id)
+
+    batch = {}
+    count = 0
+    for user_id in User.objects.values_list('id', flat=True).iterator():
+        friend_ids = friends.get(user_id, ())
+        mutual_counts = Counter()
+        for friend_id in friend_ids:
+            mutual_counts.update(friends[friend_id])
+        my_groups = groups_of.get(user_id)
+        shared_counts = {}
+        if my_groups:
+            for candidate_id in mutual_counts:
+                shared = len(my_groups & groups_of.get(candidate_id, set()))
+                if shared:
+                    shared_counts[candidate_id] = shared
+
+        batch[suggestions_key(user_id)] = rank_candidates(user_id, friend_ids, mutual_counts, shared_counts)
+        count += 1
+        if len(batch) >= batch_size:
+            cache.set_many(batch, SUGGESTION_CACHE_TIMEOUT)
+            batch = {}
+    if batch:
+        cache.set_many(batch, SUGGESTION_CACHE_TIMEOUT)
+    return count
@@ -1,3 +1,505 @@
-from django.test import TestCase
+import asyncio
+import json
+from collections import deque
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .backpressure import OutboundQueue, TokenBucket
+from .channel_layer import BrokerChannelLayer, ChannelBroker
+from .chat_history import CHAT_HISTORY_SIZE, recent_messages
+from .chat_replay import CHAT_REPLAY_SIZE, record, replay
+from .chat_stream import chat_group_name, member_removed_event, missed_events
+from .chat_writer import ChatWriter
+from .consumers import UserConsumer
+from .counters import refresh_like_counts
+from .likes import LikeBuffer
+from .models import Group, GroupMessage, GroupReadCursor, Post, User
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate
+from .read_cursors import mark_read, unread_counts
+from .typeahead import USER, PrefixIndex
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', password='x')
+        now = timezone.now()
+        # Pairs of posts share a created_at, so pages must break ties by id
+        cls.posts = [
+            Post.objects.create(user=cls.user, content=f'post {i}', created_at=now - timedelta(minutes=i // 2))
+            for i in range(7)
+        ]
+
+    def test_pages_cover_every_post_once_newest_first(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = paginate(Post.objects.all(), cursor, page_size=3)
+            seen.extend(page)
+            if cursor is None:
+                break
+        expected = sorted(self.posts, key=lambda post: (post.created_at, post.id), reverse=True)
+        self.assertEqual([post.id for post in seen], [post.id for post in expected])
+
+    def test_last_page_has_no_cursor(self):
+        page, cursor = paginate(Post.objects.all(), None, page_size=7)
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(cursor)
+
+    def test_cursor_round_trip(self):
+        post = self.posts[3]
+        self.assertEqual(decode_cursor(encode_cursor(post)), (post.created_at, post.id))
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            paginate(Post.objects.all(), 'not a cursor')
+
+
+class FeedApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='x')
+        for i in range(3):
+            Post.objects.create(user=self.user, content=f'post {i}')
+        self.client.force_login(self.user)
+
+    def test_load_more_and_v1_emit_the_same_posts(self):
+        page = self.client.get(reverse('profile_feed', args=['author'])).json()['posts']
+        response = self.client.get(reverse('api_v1_profile_feed', args=['author']))
+        streamed = json.loads(b''.join(response.streaming_content))['posts']
+        for post in page:
+            self.assertFalse(post.pop('liked'))
+        self.assertEqual(page, streamed)
+
+    def test_v1_streams_a_sync_iterator_under_wsgi(self):
+        response = self.client.get(reverse('api_v1_profile_feed', args=['author']))
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))['posts']), 3)
+
+
+class LikeBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('liker', password='x')
+        self.post = Post.objects.create(user=self.user, content='hello')
+        self.buffer = LikeBuffer(flush_interval=3600)
+        self.addCleanup(self.cancel_timer)
+
+    def cancel_timer(self):
+        if self.buffer.timer is not None:
+            self.buffer.timer.cancel()
+
+    def fetch_post(self):
+        return self.buffer.overlay([Post.objects.get(pk=self.post.pk)])[0]
+
+    def test_toggle_writes_the_like_row(self):
+        self.assertTrue(self.buffer.toggle(self.post, self.user))
+        self.assertTrue(self.post.likes.filter(pk=self.user.pk).exists())
+        self.assertFalse(self.buffer.toggle(self.post, self.user))
+        self.assertFalse(self.post.likes.filter(pk=self.user.pk).exists())
+
+    def test_overlay_adds_counts_not_yet_flushed(self):
+        self.buffer.toggle(self.post, self.user)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 0)
+        self.assertEqual(self.fetch_post().like_count, 1)
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.deltas, {})
+        self.assertEqual(self.fetch_post().like_count, 1)
+
+    def test_flush_recounts_a_snapshot(self):
+        self.buffer.toggle(self.post, self.user)
+
+        def recount(model, ids):
+            # New toggles start a new batch, and reads still see this one
+            self.assertEqual(self.buffer.deltas, {})
+            self.assertEqual(self.fetch_post().like_count, 1)
+            return refresh_like_counts(model, ids)
+
+        with mock.patch('core.likes.refresh_like_counts', side_effect=recount):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.in_flight, {})
+        self.assertEqual(self.fetch_post().like_count, 1)
+
+    def test_failed_recount_is_kept_and_retried(self):
+        self.buffer.toggle(self.post, self.user)
+        with mock.patch('core.likes.refresh_like_counts', side_effect=DatabaseError), \
+                self.assertLogs('core.likes', 'ERROR'):
+            self.buffer.flush()
+        self.assertEqual(self.fetch_post().like_count, 1)
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.deltas, {})
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+
+class ChatWriterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sender', password='x')
+        self.group = Group.objects.create(name='chat', creator=self.user)
+        self.writer = ChatWriter()
+
+    def message(self, content):
+        return self.writer.new_message(self.group.id, self.user.id, content)
+
+    def test_flush_writes_everything_queued(self):
+        messages = [self.message(f'message {i}') for i in range(3)]
+        for message in messages:
+            self.writer.enqueue(message)
+        self.writer.flush()
+        self.assertEqual(
+            list(GroupMessage.objects.filter(group=self.group).order_by('id').values_list('content', flat=True)),
+            ['message 0', 'message 1', 'message 2'],
+        )
+        self.assertEqual([message.pk for message in messages], sorted(message.pk for message in messages))
+
+    def test_bad_row_is_rejected_alone(self):
+        existing = self.message('existing')
+        self.writer.save(existing)
+        before, duplicate, after = self.message('before'), self.message('duplicate'), self.message('after')
+        duplicate.id = existing.id
+        for message in (before, duplicate, after):
+            self.writer.enqueue(message)
+        with self.assertLogs('core.chat_writer', 'WARNING'):
+            self.writer.flush()
+
+        self.assertIsNotNone(before.pk)
+        self.assertIsNone(duplicate.pk)
+        self.assertIsNotNone(after.pk)
+        self.assertEqual(GroupMessage.objects.filter(group=self.group).count(), 3)
+        self.assertEqual(self.writer.pending, deque())
+
+    def test_failed_batch_is_not_requeued(self):
+        message = self.message('lost')
+        with mock.patch.object(GroupMessage.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertLogs('core.chat_writer', 'ERROR'):
+            self.assertFalse(self.writer.save(message))
+        self.assertIsNone(message.pk)
+        self.assertEqual(self.writer.pending, deque())
+        self.assertFalse(GroupMessage.objects.filter(group=self.group).exists())
+
+
+class FriendWeightTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('popular', password='x')
+        self.friends = [User.objects.create_user(f'friend{i}', password='x') for i in range(3)]
+        self.user.friends.add(*self.friends)
+        self.index = PrefixIndex()
+        self.index.load()
+        patcher = mock.patch('core.signals.typeahead', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def weight(self, user):
+        return self.index.entries[(USER, user.pk)][1]
+
+    def test_unfriending_drops_one_edge(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('remove_friend', args=[self.friends[0].username]))
+        self.assertEqual(self.user.friends.count(), 2)
+        self.assertEqual(self.weight(self.user), 2)
+        self.assertEqual(self.weight(self.friends[0]), 0)
+
+    def test_removing_a_non_friend_changes_nothing(self):
+        self.friends[1].friends.remove(self.friends[2])
+        self.assertEqual(self.weight(self.friends[1]), 1)
+        self.assertEqual(self.weight(self.friends[2]), 1)
+
+
+class GroupMemberCountTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='x')
+        self.member = User.objects.create_user('member', password='x')
+        self.outsider = User.objects.create_user('outsider', password='x')
+        self.group = Group.objects.create(name='club', creator=self.owner)
+        self.group.members.add(self.owner, self.member)
+
+    def member_count(self):
+        return Group.objects.get(pk=self.group.pk).member_count
+
+    def test_removing_a_non_member_changes_nothing(self):
+        self.group.members.remove(self.outsider)
+        self.outsider.joined_groups.remove(self.group)
+        self.assertEqual(self.member_count(), 2)
+
+    def test_only_real_members_are_uncounted(self):
+        self.group.members.remove(self.member, self.outsider)
+        self.assertEqual(self.member_count(), 1)
+
+    def test_leaving_a_group_you_are_not_in(self):
+        self.client.force_login(self.outsider)
+        self.client.post(reverse('group_detail', args=[self.group.id]), {'leave_group': ''})
+        self.assertEqual(self.member_count(), 2)
+
+
+class ReadCursorTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', password='x')
+        self.other = User.objects.create_user('other', password='x')
+        self.group = Group.objects.create(name='chat', creator=self.other)
+        self.group.members.add(self.other)
+        self.send(self.other, 'before joining')
+        self.group.members.add(self.reader)
+
+    def send(self, sender, content):
+        return GroupMessage.objects.create(group=self.group, sender=sender, content=content)
+
+    def test_joining_starts_at_the_newest_message(self):
+        self.assertEqual(unread_counts(self.reader.id), {self.group.id: 0})
+
+    def test_counts_other_members_messages_after_the_cursor(self):
+        self.send(self.other, 'one')
+        self.send(self.reader, 'mine')
+        last = self.send(self.other, 'two')
+        self.assertEqual(unread_counts(self.reader.id), {self.group.id: 2})
+
+        mark_read(self.reader.id, self.group.id, last.id)
+        self.assertEqual(unread_counts(self.reader.id), {self.group.id: 0})
+
+    def test_mark_read_never_moves_backwards(self):
+        first = self.send(self.other, 'one')
+        second = self.send(self.other, 'two')
+        mark_read(self.reader.id, self.group.id, second.id)
+        mark_read(self.reader.id, self.group.id, first.id)
+        cursor = GroupReadCursor.objects.get(user=self.reader, group=self.group)
+        self.assertEqual(cursor.last_read_id, second.id)
+
+    def test_leaving_drops_the_cursor(self):
+        self.group.members.remove(self.reader)
+        self.assertEqual(unread_counts(self.reader.id), {})
+
+
+class ChatReplayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sender', password='x')
+        self.group = Group.objects.create(name='chat', creator=self.user)
+        shared = mock.patch('core.chat_replay.cache_is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+    def send(self, content):
+        message = GroupMessage.objects.create(group=self.group, sender=self.user, content=content)
+        return record(self.group.id, {'id': message.id, 'message': content})
+
+    def test_replays_the_gap_after_the_clients_last_message(self):
+        first, second, third = self.send('one'), self.send('two'), self.send('three')
+        self.assertEqual([first['seq'], second['seq'], third['seq']], [1, 2, 3])
+        self.assertEqual(replay(self.group.id, first['seq'], first['id']), [second, third])
+        self.assertEqual(replay(self.group.id, third['seq'], third['id']), [])
+
+    def test_unknown_anchor_is_not_replayed(self):
+        first = self.send('one')
+        self.send('two')
+        self.assertIsNone(replay(self.group.id, first['seq'], first['id'] + 1000))
+        self.assertIsNone(replay(self.group.id, 99, first['id']))
+
+    def test_gap_longer_than_the_ring_is_not_replayed(self):
+        first = self.send('first')
+        for i in range(CHAT_REPLAY_SIZE):
+            self.send(str(i))
+        self.assertIsNone(replay(self.group.id, first['seq'], first['id']))
+
+    def test_missed_events_falls_back_to_the_database(self):
+        first = self.send('one')
+        cache.clear()
+        self.send('two')
+        self.send('three')
+        events = missed_events(self.group.id, first['seq'], first['id'])
+        self.assertEqual([event['message'] for event in events], ['two', 'three'])
+
+    def test_nothing_is_numbered_without_a_shared_cache(self):
+        with mock.patch('core.chat_replay.cache_is_shared', return_value=False):
+            event = self.send('one')
+        self.assertNotIn('seq', event)
+        self.assertIsNone(replay(self.group.id, 1, event['id']))
+
+
+class SocketClient(ApplicationCommunicator):
+    """Drives a websocket consumer without a server (channels.testing needs daphne)."""
+
+    def __init__(self, consumer, user, path='/ws/user/'):
+        super().__init__(consumer.as_asgi(), {
+            'type': 'websocket',
+            'path': path,
+            'headers': [],
+            'subprotocols': [],
+            'query_string': b'',
+            'user': user,
+        })
+
+    async def connect(self):
+        await self.send_input({'type': 'websocket.connect'})
+        return (await self.receive_output(1))['type'] == 'websocket.accept'
+
+    async def send_json(self, data):
+        await self.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self):
+        return json.loads((await self.receive_output(1))['text'])
+
+    async def close(self):
+        await self.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.wait(1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class UserConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = User.objects.create_user('member', password='x')
+        self.outsider = User.objects.create_user('outsider', password='x')
+        self.group = Group.objects.create(name='chat', creator=self.member)
+        self.group.members.add(self.member)
+
+    async def test_anonymous_users_are_refused(self):
+        client = SocketClient(UserConsumer, AnonymousUser())
+        self.assertFalse(await client.connect())
+
+    async def test_outsiders_cannot_subscribe_or_send(self):
+        client = SocketClient(UserConsumer, self.outsider)
+        self.assertTrue(await client.connect())
+        await client.send_json({'action': 'subscribe', 'topic': 'group', 'id': self.group.id})
+        self.assertEqual((await client.receive_json())['message'], 'Not a member')
+        await client.send_json({'action': 'send', 'topic': 'group', 'id': self.group.id, 'message': 'hi'})
+        self.assertEqual((await client.receive_json())['message'], f'Cannot send on group {self.group.id}')
+        await client.close()
+        self.assertFalse(await GroupMessage.objects.filter(group=self.group).aexists())
+
+    async def test_members_receive_messages_after_they_are_written(self):
+        client = SocketClient(UserConsumer, self.member)
+        self.assertTrue(await client.connect())
+        await client.send_json({'action': 'subscribe', 'topic': 'group', 'id': self.group.id})
+        await client.send_json({'action': 'send', 'topic': 'group', 'id': self.group.id, 'message': 'hi'})
+        frame = await client.receive_json()
+        self.assertEqual((frame['topic'], frame['id'], frame['type']), ('group', self.group.id, 'chat_message'))
+        self.assertEqual(frame['message'], 'hi')
+        message = await GroupMessage.objects.aget(group=self.group)
+        self.assertEqual(frame['message_id'], message.id)
+        await client.close()
+
+    async def test_removed_members_are_unsubscribed(self):
+        client = SocketClient(UserConsumer, self.member)
+        self.assertTrue(await client.connect())
+        await client.send_json({'action': 'subscribe', 'topic': 'group', 'id': self.group.id})
+        # Nothing comes back once the subscription is in place
+        self.assertTrue(await client.receive_nothing(0.2))
+        await get_channel_layer().group_send(
+            chat_group_name(self.group.id), member_removed_event(self.group.id, [self.member.id])
+        )
+        self.assertEqual((await client.receive_json())['message'], 'Removed from the group')
+        await client.send_json({'action': 'send', 'topic': 'group', 'id': self.group.id, 'message': 'hi'})
+        self.assertEqual((await client.receive_json())['message'], f'Cannot send on group {self.group.id}')
+        await client.close()
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = User.objects.create_user('member', password='x')
+        self.group = Group.objects.create(name='chat', creator=self.member)
+        self.group.members.add(self.member)
+        GroupMessage.objects.bulk_create([
+            GroupMessage(group=self.group, sender=self.member, content=str(i))
+            for i in range(CHAT_HISTORY_SIZE + 30)
+        ])
+        self.client.force_login(self.member)
+
+    def test_pages_reach_back_past_the_cached_history(self):
+        url = reverse('group_chat_history', args=[self.group.id])
+        seen = [event['id'] for event in recent_messages(self.group.id)]
+        cursor = seen[-1]
+        while cursor is not None:
+            data = self.client.get(url, {'before': cursor}).json()
+            seen.extend(message['id'] for message in data['messages'])
+            cursor = data['next_cursor']
+        expected = list(GroupMessage.objects.filter(group=self.group).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cached_history_sees_messages_from_other_workers(self):
+        recent_messages(self.group.id)
+        # Written without going through this process's replay ring
+        message = GroupMessage.objects.create(group=self.group, sender=self.member, content='elsewhere')
+        self.assertEqual(recent_messages(self.group.id)[0]['id'], message.id)
+
+    def test_history_is_for_members_only(self):
+        self.client.force_login(User.objects.create_user('outsider', password='x'))
+        response = self.client.get(reverse('group_chat_history', args=[self.group.id]), {'before': 1})
+        self.assertEqual(response.status_code, 403)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_allows_a_burst_then_refills_at_the_rate(self):
+        with mock.patch('core.backpressure.time.monotonic', return_value=100.0) as clock:
+            bucket = TokenBucket(rate=2, burst=3)
+            self.assertEqual([bucket.allow() for _ in range(4)], [True, True, True, False])
+            clock.return_value = 100.5
+            self.assertTrue(bucket.allow())
+            self.assertFalse(bucket.allow())
+            # Idle time never banks more than the burst
+            clock.return_value = 1000.0
+            self.assertEqual([bucket.allow() for _ in range(4)], [True, True, True, False])
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+
+    async def send(self, text_data):
+        self.sent.append(text_data)
+
+    async def test_drops_the_oldest_frame_when_full(self):
+        queue = OutboundQueue(self.send, maxsize=2)
+        for text in ('a', 'b', 'c'):
+            queue.put(text)
+        queue.start()
+        await asyncio.sleep(0)
+        queue.stop()
+        self.assertEqual(self.sent, ['b', 'c'])
+
+    async def test_keyed_frames_replace_the_queued_one(self):
+        queue = OutboundQueue(self.send)
+        queue.put('online', key='presence')
+        queue.put('message')
+        queue.put('offline', key='presence')
+        queue.start()
+        await asyncio.sleep(0)
+        queue.stop()
+        self.assertEqual(self.sent, ['offline', 'message'])
+
+    async def test_frames_after_a_drain_are_sent_too(self):
+        queue = OutboundQueue(self.send)
+        queue.start()
+        queue.put('first')
+        await asyncio.sleep(0)
+        queue.put('second', key='presence')
+        await asyncio.sleep(0)
+        queue.stop()
+        self.assertEqual(self.sent, ['first', 'second'])
+
+
+class BrokerChannelLayerTests(SimpleTestCase):
+    async def test_cancelled_receive_hands_back_its_message(self):
+        server = await ChannelBroker(InMemoryChannelLayer()).serve('127.0.0.1:0')
+        port = server.sockets[0].getsockname()[1]
+        layer = BrokerChannelLayer(address=f'127.0.0.1:{port}')
+        try:
+            receive = asyncio.ensure_future(layer.receive('test.channel'))
+            await asyncio.sleep(0.05)
+            # The broker hands the message to the waiting receive, which is
+            # cancelled before the answer is read
+            await layer.send('test.channel', {'type': 'test.message'})
+            receive.cancel()
+            message = await asyncio.wait_for(layer.receive('test.channel'), 1)
+            self.assertEqual(message, {'type': 'test.message'})
+        finally:
+            await layer.close()
+            server.close()
+            await server.wait_closed()
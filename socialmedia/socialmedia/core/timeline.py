@@ -0,0 +1,83 @@
+# core/timeline.py
+#
+# Fan-out-on-write home timelines. Every user has a bounded list of post ids
+# (newest first) kept in the cache. When a post is created its id is pushed
+# to the author's timeline and to each friend's timeline, so the home page
+# only has to read one list instead of running the friends OR-join.
+#
+# The lists live in the default cache, and updating one is a read followed
+# by a write: two posts pushed at the same moment can lose one of them, and
+# with a per-process cache a push, removal or invalidation reaches only the
+# worker that made it. Either way the list is wrong until it is rebuilt, so
+# lists are rebuilt with one query once they are TIMELINE_CACHE_TIMEOUT
+# seconds old, however often posts were pushed to them since. Deleted posts
+# never show either way: the feed only renders ids that still exist.
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Post, User
+
+TIMELINE_MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 500)
+TIMELINE_CACHE_TIMEOUT = getattr(settings, 'TIMELINE_CACHE_TIMEOUT', 5 * 60)
+
+
+def timeline_key(user_id):
+    return f'timeline:v2:{user_id}'
+
+
+def audience_ids(user_id):
+    # The author plus everyone who is friends with them
+    friend_ids = User.objects.filter(id=user_id).values_list('friends__id', flat=True)
+    return [user_id] + [friend_id for friend_id in friend_ids if friend_id is not None]
+
+
+def rebuild_timeline(user_id):
+    friend_ids = User.objects.filter(id=user_id).values_list('friends__id', flat=True)
+    post_ids = list(
+        Post.objects.filter(Q(user_id=user_id) | Q(user_id__in=friend_ids))
+        .order_by('-created_at', '-id')
+        .values_list('id', flat=True)[:TIMELINE_MAX_LENGTH]
+    )
+    # Stamped with the build time; pushes keep the stamp
+    cache.set(timeline_key(user_id), (time.time(), post_ids), TIMELINE_CACHE_TIMEOUT)
+    return post_ids
+
+
+def get_timeline(user):
+    entry = cache.get(timeline_key(user.id))
+    if entry is None or time.time() - entry[0] > TIMELINE_CACHE_TIMEOUT:
+        return rebuild_timeline(user.id)
+    return entry[1]
+
+
+def push_post(post):
+    keys = [timeline_key(user_id) for user_id in audience_ids(post.user_id)]
+    # Only timelines that are already materialised are updated; missing ones
+    # are rebuilt from the database the next time they are read.
+    timelines = cache.get_many(keys)
+    for key, (built_at, post_ids) in timelines.items():
+        if post.id not in post_ids:
+            post_ids.insert(0, post.id)
+            del post_ids[TIMELINE_MAX_LENGTH:]
+    if timelines:
+        cache.set_many(timelines, TIMELINE_CACHE_TIMEOUT)
+
+
+def remove_post(post):
+    keys = [timeline_key(user_id) for user_id in audience_ids(post.user_id)]
+    timelines = cache.get_many(keys)
+    changed = {}
+    for key, (built_at, post_ids) in timelines.items():
+        if post.id in post_ids:
+            post_ids.remove(post.id)
+            changed[key] = (built_at, post_ids)
+    if changed:
+        cache.set_many(changed, TIMELINE_CACHE_TIMEOUT)
+
+
+def invalidate_timelines(user_ids):
+    cache.delete_many([timeline_key(user_id) for user_id in user_ids])
+
@@ -0,0 +1,144 @@
+# core/trending.py
+#
+# "Trending now" counters. Events are counted per TRENDING_BUCKET_SECONDS
+# bucket, so old events fall out of a window as their buckets age. Each
+# process adds events to an in-memory Counter, which is a dict increment
+# on the request path; a background timer adds the counts to the shared
+# TrendingCount table every TRENDING_FLUSH_INTERVAL seconds (and at exit).
+# Every worker adds to the same rows, so the table holds the whole site's
+# counts, and a restart loses at most one interval of this process's
+# events.
+#
+# Top-K over a window is one aggregate over the window's buckets, cached
+# for TRENDING_TOP_CACHE_TIMEOUT seconds. Buckets older than the longest
+# window are deleted as counts are flushed.
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Sum
+
+from .models import TrendingCount
+
+logger = logging.getLogger(__name__)
+
+TRENDING_BUCKET_SECONDS = getattr(settings, 'TRENDING_BUCKET_SECONDS', 60)
+TRENDING_MAX_WINDOW = getattr(settings, 'TRENDING_MAX_WINDOW', timedelta(hours=24))
+TRENDING_FLUSH_INTERVAL = getattr(settings, 'TRENDING_FLUSH_INTERVAL', 10)
+TRENDING_MAX_PENDING = getattr(settings, 'TRENDING_MAX_PENDING', 100000)
+TRENDING_TOP_CACHE_TIMEOUT = getattr(settings, 'TRENDING_TOP_CACHE_TIMEOUT', 30)
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+}
+
+
+def bucket_of(now):
+    return int(now // TRENDING_BUCKET_SECONDS)
+
+
+def window_buckets(window):
+    return max(1, int(window.total_seconds() // TRENDING_BUCKET_SECONDS))
+
+
+class TrendingTracker:
+    def __init__(self, kinds, flush_interval=TRENDING_FLUSH_INTERVAL, max_pending=TRENDING_MAX_PENDING):
+        self.kinds = kinds
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.timer = None
+        # (kind, bucket, key) -> events not yet in the table
+        self.pending = Counter()
+
+    def record(self, kind, key, amount=1):
+        """Count an event once the current transaction commits."""
+        if kind not in self.kinds:
+            raise ValueError(f'Unknown trending kind {kind!r}')
+        transaction.on_commit(lambda: self._add(kind, key, amount))
+
+    def _add(self, kind, key, amount):
+        with self.lock:
+            self.pending[(kind, bucket_of(time.time()), key)] += amount
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def top(self, kind, k=10, window=WINDOWS['1h']):
+        """Return [(key, count)] for the ``k`` keys with most events in ``window``."""
+        span = window_buckets(window)
+        cache_key = f'trending:{kind}:{span}:{k}'
+        top = cache.get(cache_key)
+        if top is None:
+            current = bucket_of(time.time())
+            top = list(
+                TrendingCount.objects
+                .filter(kind=kind, bucket__gt=current - span, bucket__lte=current)
+                .values_list('key')
+                .annotate(total=Sum('count'))
+                .order_by('-total', '-key')[:k]
+            )
+            cache.set(cache_key, top, TRENDING_TOP_CACHE_TIMEOUT)
+        return top
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Timer threads get their own database connections
+            connections.close_all()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                batch, self.pending = self.pending, Counter()
+            if not batch:
+                return
+
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Error writing %d trending counts; requeueing', len(batch))
+                with self.lock:
+                    self.pending.update(batch)
+                    if len(self.pending) > self.max_pending:
+                        # Keep memory bounded while the database is down
+                        logger.error('Dropped %d unwritten trending counts', len(self.pending))
+                        self.pending = Counter()
+                    elif self.timer is None:
+                        self.timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                        self.timer.daemon = True
+                        self.timer.start()
+
+    def _write(self, batch):
+        # Make sure every row exists, then add to it in place; rows that
+        # get the same amount share one UPDATE
+        by_amount = defaultdict(list)
+        for (kind, bucket, key), amount in batch.items():
+            by_amount[(kind, bucket, amount)].append(key)
+        with transaction.atomic():
+            TrendingCount.objects.bulk_create(
+                [TrendingCount(kind=kind, bucket=bucket, key=key) for kind, bucket, key in batch],
+                ignore_conflicts=True,
+            )
+            for (kind, bucket, amount), keys in by_amount.items():
+                TrendingCount.objects.filter(kind=kind, bucket=bucket, key__in=keys).update(count=F('count') + amount)
+
+        oldest = bucket_of(time.time()) - window_buckets(TRENDING_MAX_WINDOW)
+        TrendingCount.objects.filter(kind__in=self.kinds, bucket__lte=oldest).delete()
+
+
+trending = TrendingTracker(['posts', 'groups'])
+atexit.register(trending.flush)
@@ -0,0 +1,234 @@
+# core/typeahead.py
+#
+# In-memory prefix index for the search box autocomplete. Every username
+# and public group name (and each later word of a group name) is a key in
+# one sorted list, so the candidates for a prefix are a contiguous run found
+# with bisect. Each entry carries a popularity weight (friend count for
+# users, member count for groups) and the top matches by weight are
+# returned. Runs short enough to scan (TYPEAHEAD_MAX_SCAN keys) are ranked
+# on the spot; every prefix with a longer run gets its top entries computed
+# at load time and kept up to date as weights change, so "a" ranks the
+# whole site, not just the first few thousand names after it.
+#
+# The index loads from the database on first use (one request loads it,
+# the others wait for it), is patched by the model signals as users and
+# groups are created, renamed or deleted, and is rebuilt in a background
+# thread every TYPEAHEAD_RELOAD_INTERVAL seconds to pick up changes made by
+# other processes while lookups keep using the current copy.
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+
+from .models import Group, User
+
+TYPEAHEAD_LIMIT = getattr(settings, 'TYPEAHEAD_LIMIT', 8)
+TYPEAHEAD_MAX_SCAN = getattr(settings, 'TYPEAHEAD_MAX_SCAN', 2000)
+TYPEAHEAD_RELOAD_INTERVAL = getattr(settings, 'TYPEAHEAD_RELOAD_INTERVAL', 600)
+# Entries kept per kind for a long run; the slack over TYPEAHEAD_LIMIT
+# covers entries whose weight drops before the next reload
+TYPEAHEAD_TOP_SIZE = getattr(settings, 'TYPEAHEAD_TOP_SIZE', 2 * TYPEAHEAD_LIMIT)
+
+USER = 'user'
+GROUP = 'group'
+
+
+def entry_keys(kind, label):
+    label = label.lower()
+    if kind == USER:
+        return [label]
+    words = label.split()
+    return [' '.join(words[i:]) for i in range(len(words))] or [label]
+
+
+class PrefixIndex:
+    def __init__(self, reload_interval=TYPEAHEAD_RELOAD_INTERVAL, max_scan=TYPEAHEAD_MAX_SCAN,
+                 top_size=TYPEAHEAD_TOP_SIZE):
+        self.reload_interval = reload_interval
+        self.max_scan = max_scan
+        self.top_size = top_size
+        self.lock = threading.Lock()
+        # Held while loading, so only one thread rebuilds at a time
+        self.load_lock = threading.Lock()
+        self.loaded_at = None
+        # Sorted (key, kind, id) tuples
+        self.keys = []
+        # (kind, id) -> [label, weight, keys]
+        self.entries = {}
+        # prefix -> {kind: [id, ...]} for every prefix whose run is longer
+        # than max_scan. If a prefix is in here, so are all its prefixes.
+        self.top = {}
+
+    def _rows(self):
+        friend_counts = dict(
+            User.friends.through.objects.values_list('from_user_id').annotate(n=Count('*')).order_by()
+        )
+        for user_id, username in User.objects.filter(is_active=True).values_list('id', 'username').iterator():
+            yield USER, user_id, username, friend_counts.get(user_id, 0)
+
+        member_counts = dict(
+            Group.members.through.objects.values_list('group_id').annotate(n=Count('*')).order_by()
+        )
+        for group_id, name in Group.objects.filter(privacy='public').values_list('id', 'name').iterator():
+            yield GROUP, group_id, name, member_counts.get(group_id, 0)
+
+    def load(self):
+        with self.load_lock:
+            self._load()
+
+    def _load(self):
+        # Called with self.load_lock held
+        keys = []
+        entries = {}
+        for kind, obj_id, label, weight in self._rows():
+            entry_key = entry_keys(kind, label)
+            entries[(kind, obj_id)] = [label, weight, entry_key]
+            keys.extend((key, kind, obj_id) for key in entry_key)
+        keys.sort()
+        top = {}
+        self._build_top(keys, entries, top, '', 0, len(keys))
+        with self.lock:
+            self.keys = keys
+            self.entries = entries
+            self.top = top
+            self.loaded_at = time.monotonic()
+
+    def _build_top(self, keys, entries, top, prefix, start, end):
+        # Walk down the prefixes whose runs are too long to scan. Each level
+        # splits its run into disjoint child runs, so this reads every key
+        # once per level of long prefixes above it.
+        depth = len(prefix)
+        i = start
+        while i < end:
+            key = keys[i][0]
+            if len(key) == depth:
+                i += 1
+                continue
+            child = key[:depth + 1]
+            j = bisect_left(keys, (child + '\U0010ffff',), i, end)
+            if j - i > self.max_scan:
+                top[child] = self._rank(keys[i:j], entries, self.top_size)
+                self._build_top(keys, entries, top, child, i, j)
+            i = j
+
+    @staticmethod
+    def _rank(run, entries, limit):
+        """{kind: [id, ...]} of the ``limit`` heaviest entries per kind in ``run``."""
+        found = {USER: set(), GROUP: set()}
+        for _, kind, obj_id in run:
+            found[kind].add(obj_id)
+        return {
+            kind: heapq.nlargest(limit, ids, key=lambda obj_id: (entries[(kind, obj_id)][1], -obj_id))
+            for kind, ids in found.items()
+        }
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None:
+            with self.load_lock:
+                # Another thread may have loaded it while this one waited
+                if self.loaded_at is None:
+                    self._load()
+        elif time.monotonic() - self.loaded_at > self.reload_interval and not self.load_lock.locked():
+            threading.Thread(target=self._reload, daemon=True).start()
+
+    def _reload(self):
+        if not self.load_lock.acquire(blocking=False):
+            return  # another thread is already reloading
+        try:
+            self._load()
+        finally:
+            self.load_lock.release()
+            # Reload threads get their own database connections
+            connections.close_all()
+
+    def lookup(self, prefix, limit=TYPEAHEAD_LIMIT):
+        """Return {'user': [...], 'group': [...]} of (id, label) pairs, most popular first."""
+        self._ensure_loaded()
+        prefix = prefix.lower()
+        with self.lock:
+            ranked = self.top.get(prefix)
+            if ranked is None:
+                start = bisect_left(self.keys, (prefix,))
+                end = bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+                ranked = self._rank(self.keys[start:end], self.entries, limit)
+            return {
+                kind: [
+                    (obj_id, self.entries[(kind, obj_id)][0]) for obj_id in
+                    heapq.nlargest(limit, ids, key=lambda obj_id: (self.entries[(kind, obj_id)][1], -obj_id))
+                ]
+                for kind, ids in ranked.items()
+            }
+
+    def put(self, kind, obj_id, label, weight=None):
+        """Add or rename an entry; a new entry starts at weight 0."""
+        if self.loaded_at is None:
+            return  # the first lookup loads everything
+        with self.lock:
+            entry = self.entries.get((kind, obj_id))
+            if entry is not None:
+                if entry[0] == label and weight is None:
+                    return
+                self._remove_keys(kind, obj_id, entry[2])
+            new_keys = entry_keys(kind, label)
+            weight = weight if weight is not None else (entry[1] if entry is not None else 0)
+            self.entries[(kind, obj_id)] = [label, weight, new_keys]
+            for key in new_keys:
+                insort(self.keys, (key, kind, obj_id))
+            self._promote(kind, obj_id)
+
+    def discard(self, kind, obj_id):
+        with self.lock:
+            entry = self.entries.pop((kind, obj_id), None)
+            if entry is not None:
+                self._remove_keys(kind, obj_id, entry[2])
+
+    def adjust_weight(self, kind, obj_id, delta):
+        with self.lock:
+            entry = self.entries.get((kind, obj_id))
+            if entry is not None:
+                entry[1] = max(0, entry[1] + delta)
+                if delta > 0:
+                    self._promote(kind, obj_id)
+
+    def _long_prefixes(self, keys):
+        for key in keys:
+            for end in range(1, len(key) + 1):
+                if key[:end] not in self.top:
+                    break
+                yield key[:end]
+
+    def _promote(self, kind, obj_id):
+        # Called with self.lock held, after the entry's weight went up or
+        # it got new keys: it may now belong in some long runs' top lists.
+        # A weight going down leaves it in place (lookups re-sort by the
+        # current weights); an entry it should now make room for comes
+        # back with the next reload.
+        _, weight, keys = self.entries[(kind, obj_id)]
+        rank = (weight, -obj_id)
+        for prefix in set(self._long_prefixes(keys)):
+            ids = self.top[prefix][kind]
+            if obj_id in ids:
+                continue
+            if len(ids) < self.top_size:
+                ids.append(obj_id)
+                continue
+            weakest = min(ids, key=lambda other: (self.entries[(kind, other)][1], -other))
+            if rank > (self.entries[(kind, weakest)][1], -weakest):
+                ids[ids.index(weakest)] = obj_id
+
+    def _remove_keys(self, kind, obj_id, keys):
+        for prefix in set(self._long_prefixes(keys)):
+            ids = self.top[prefix][kind]
+            if obj_id in ids:
+                ids.remove(obj_id)
+        for key in keys:
+            i = bisect_left(self.keys, (key, kind, obj_id))
+            if i < len(self.keys) and self.keys[i] == (key, kind, obj_id):
+                del self.keys[i]
+
+
+typeahead = PrefixIndex()
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api, chat_stream
 from django.contrib.auth import views as auth_views
 from django.contrib.sites.shortcuts import get_current_site
 from .views import EmailTestView
@@ -24,7 +24,19 @@ urlpatterns = [
     path('post/<int:post_id>/', views.post_detail, name='post_detail'),
     path('post/<int:post_id>/like/', views.like_post, name='like_post'),
     path('post/<int:post_id>/delete/', views.delete_post, name='delete_post'),
-    
+
+    # Feed API URLs ("load more")
+    path('api/feed/home/', views.home_feed, name='home_feed'),
+    path('api/feed/for-you/', views.for_you_feed, name='for_you_feed'),
+    path('api/feed/profile/<str:username>/', views.profile_feed, name='profile_feed'),
+    path('api/feed/group/<int:group_id>/', views.group_feed, name='group_feed'),
+    path('api/trending/', views.trending_now, name='trending_now'),
+
+    # Versioned streaming feed API
+    path('api/v1/feed/home/', api.home_feed, name='api_v1_home_feed'),
+    path('api/v1/feed/profile/<str:username>/', api.profile_feed, name='api_v1_profile_feed'),
+    path('api/v1/feed/group/<int:group_id>/', api.group_feed, name='api_v1_group_feed'),
+
     # Friend URLs
     path('friends/', views.friends, name='friends'),
     path('friend-request/<str:username>/', views.send_friend_request, name='send_friend_request'),
@@ -35,6 +47,8 @@ urlpatterns = [
     
     # Search URL
     path('search/', views.search, name='search'),
+    path('api/typeahead/', views.typeahead_search, name='typeahead'),
+    path('api/search/content/', views.content_search, name='content_search'),
     
     # Password Reset URLs
     path('password-reset/', 
@@ -72,11 +86,13 @@ urlpatterns = [
     path('groups/', views.groups, name='groups'),
     path('group/<int:group_id>/', views.group_detail, name='group_detail'),
     path('group/<int:group_id>/chat/', views.group_chat, name='group_chat'),
+    path('group/<int:group_id>/chat/stream/', chat_stream.group_chat_stream, name='group_chat_stream'),
+    path('group/<int:group_id>/chat/history/', views.group_chat_history, name='group_chat_history'),
     # path('group/<int:group_id>/send-message/', views.send_group_message, name='send_group_message'),
     # path('group/<int:group_id>/start-call/', views.start_group_call, name='start_group_call'),
     # path('call/<int:call_id>/end/', views.end_group_call, name='end_group_call'),
     # path('call/<int:call_id>/join/', views.join_group_call, name='join_group_call'),
-    # path('group-post/<int:post_id>/like/', views.like_group_post, name='like_group_post'),
+    path('group-post/<int:post_id>/like/', views.like_group_post, name='like_group_post'),
      path('groups/<int:group_id>/edit/', views.group_edit, name='group_edit'),
     path('groups/<int:group_id>/delete/', views.group_delete, name='group_delete'),  # Ensure group_delete is also defined
 ]
@@ -8,8 +8,8 @@ from django.contrib.auth.views import (
     PasswordResetCompleteView
 )
 from django.contrib import messages
-from django.db.models import Q, Count
-from django.urls import reverse_lazy
+from django.db.models import Q, Count, Exists, OuterRef, Subquery
+from django.urls import reverse, reverse_lazy
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST, require_GET
 from django.utils import timezone
@@ -20,6 +20,8 @@ import json
 from datetime import timedelta
 from django.contrib.auth.tokens import default_token_generator
 import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 
 from .forms import (
     CustomUserCreationForm, 
@@ -44,6 +46,24 @@ from .models import (
     GroupCall,
     Notification
 )
+from .timeline import get_timeline
+from .api import GROUP_POST_FIELDS, POST_FIELDS, export_object
+from .likes import annotate_liked, like_buffer
+from .pagination import paginate, paginate_ids, paginate_request, get_page_size, InvalidCursor
+from .ranking import paginate_for_you
+from .trending import trending, WINDOWS
+from .friend_graph import friend_graph
+from .suggestions import get_suggestions
+from .search_index import search_user_ids
+from .typeahead import GROUP, USER, typeahead
+from .content_search import MODELS as SEARCHABLE_CONTENT, search_content
+from .group_recommendations import sample_recommendations
+from .memberships import is_group_member
+from .chat_writer import chat_writer
+from .chat_stream import chat_group_name, message_data, message_event
+from .chat_history import CHAT_HISTORY_PAGE_SIZE, older_messages, recent_messages
+from .chat_replay import record
+from .read_cursors import mark_read, unread_counts
 
 
 logger = logging.getLogger(__name__)
@@ -54,16 +74,16 @@ logger = logging.getLogger(__name__)
 
 def home(request):
     if request.user.is_authenticated:
-        try:
-            friends = request.user.friends.all()
-            posts = Post.objects.filter(
-                Q(user=request.user) | 
-                Q(user__in=friends)
-            ).order_by('-created_at')
-        except AttributeError:
-            posts = Post.objects.filter(user=request.user).order_by('-created_at')
-            messages.warning(request, "Friends feature not properly configured")
-        
+        # Precomputed fan-out timeline instead of the friends OR-join
+        posts, next_cursor = paginate_request(
+            request,
+            annotate_liked(
+                Post.objects.filter(id__in=get_timeline(request.user)).select_related('user'),
+                request.user
+            )
+        )
+        like_buffer.overlay(posts)
+
         form = PostForm()
         
         if request.method == 'POST':
@@ -85,7 +105,7 @@ def home(request):
                 messages.success(request, 'Post created successfully!')
                 return redirect('home')
         
-        context = {'posts': posts, 'form': form}
+        context = {'posts': posts, 'form': form, 'next_cursor': next_cursor}
         return render(request, 'core/home.html', context)
     return render(request, 'core/landing.html')
 def landing(request):
@@ -135,9 +155,14 @@ def user_logout(request):
 @login_required
 def profile(request, username):
     user = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(user=user).order_by('-created_at')
+    posts, next_cursor = paginate_request(
+        request,
+        annotate_liked(Post.objects.filter(user=user).select_related('user'), request.user)
+    )
+    like_buffer.overlay(posts)
     is_self = request.user == user
-    is_friend = request.user in user.friends.all()
+    is_friend = friend_graph.are_friends(request.user.id, user.id)
+    mutual_friend_count = 0 if is_self else friend_graph.mutual_friend_count(request.user.id, user.id)
     
     friend_request = None
     if not is_self and not is_friend:
@@ -149,8 +174,11 @@ def profile(request, username):
     context = {
         'profile_user': user,
         'posts': posts,
+        'next_cursor': next_cursor,
         'is_self': is_self,
         'is_friend': is_friend,
+        'friend_count': friend_graph.friend_count(user.id),
+        'mutual_friend_count': mutual_friend_count,
         'friend_request': friend_request,
     }
     return render(request, 'core/profile.html', context)
@@ -173,7 +201,8 @@ def edit_profile(request):
 
 @login_required
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(annotate_liked(Post.objects.all(), request.user), id=post_id)
+    like_buffer.overlay([post])
     comments = Comment.objects.filter(post=post).order_by('created_at')
     
     if request.method == 'POST':
@@ -195,14 +224,21 @@ def post_detail(request, post_id):
     }
     return render(request, 'core/post_detail.html', context)
 
+@require_POST
 @login_required
 def like_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    if request.user in post.likes.all():
-        post.likes.remove(request.user)
-    else:
-        post.likes.add(request.user)
-    return redirect(request.META.get('HTTP_REFERER', 'home'))
+    # The like row is written now; like_count is recounted by the next flush
+    liked = like_buffer.toggle(post, request.user)
+    if liked:
+        trending.record('posts', post.id)
+    like_buffer.overlay([post])
+
+    return JsonResponse({
+        'status': 'success',
+        'liked': liked,
+        'like_count': post.like_count,
+    })
 
 @login_required
 def delete_post(request, post_id):
@@ -224,11 +260,33 @@ def friends(request):
     
     context = {
         'friends': friends,
+        'suggestions': people_you_may_know(user),
         'incoming_requests': incoming_requests,
         'outgoing_requests': outgoing_requests,
     }
     return render(request, 'core/friends.html', context)
 
+def people_you_may_know(user):
+    rows = get_suggestions(user)
+    if not rows:
+        return []
+    # Drop anyone with a request already pending in either direction
+    candidate_ids = [candidate_id for candidate_id, _, _ in rows]
+    pending = set(FriendRequest.objects.filter(from_user=user, to_user_id__in=candidate_ids, accepted=False)
+                  .values_list('to_user_id', flat=True))
+    pending.update(FriendRequest.objects.filter(to_user=user, from_user_id__in=candidate_ids, accepted=False)
+                   .values_list('from_user_id', flat=True))
+    users = User.objects.in_bulk([candidate_id for candidate_id in candidate_ids if candidate_id not in pending])
+
+    suggestions = []
+    for candidate_id, mutual, shared in rows:
+        if candidate_id in users:
+            candidate = users[candidate_id]
+            candidate.mutual_friend_count = mutual
+            candidate.shared_group_count = shared
+            suggestions.append(candidate)
+    return suggestions
+
 @login_required
 def send_friend_request(request, username):
     to_user = get_object_or_404(User, username=username)
@@ -272,8 +330,8 @@ def cancel_friend_request(request, request_id):
 @login_required
 def remove_friend(request, username):
     friend = get_object_or_404(User, username=username)
+    # friends is symmetrical: this drops both directions
     request.user.friends.remove(friend)
-    friend.friends.remove(request.user)
     
     FriendRequest.objects.filter(
         Q(from_user=request.user, to_user=friend) | 
@@ -287,29 +345,113 @@ def remove_friend(request, username):
 # Search View
 # ======================
 
+SEARCH_MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 200)
+
+def search_page(request, query, cursor):
+    user = request.user
+    user_ids = search_user_ids(query, exclude_id=user.id, limit=SEARCH_MAX_RESULTS)
+    page_ids, next_cursor = paginate_ids(user_ids, cursor, get_page_size(request))
+
+    # Request state for the whole page comes from two subqueries in the same
+    # query, and friend state from the friend graph
+    users = User.objects.annotate(
+        pending_request=Exists(
+            FriendRequest.objects.filter(from_user=user, to_user=OuterRef('pk'), accepted=False)
+        ),
+        incoming_request_id=Subquery(
+            FriendRequest.objects.filter(from_user=OuterRef('pk'), to_user=user, accepted=False).values('id')[:1]
+        ),
+    ).in_bulk(page_ids)
+    users = [users[user_id] for user_id in page_ids if user_id in users]
+    return friend_graph.annotate(users, user.id), next_cursor
+
 @login_required
 def search(request):
     query = request.GET.get('q', '')
     users = []
+    next_cursor = None
     
     if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) | 
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query) | 
-            Q(bio__icontains=query)
-        ).exclude(id=request.user.id)
-        
-        for user in users:
-            user.is_friend = user in request.user.friends.all()
-            user.pending_request = FriendRequest.objects.filter(
-                from_user=request.user,
-                to_user=user
-            ).exists()
-    
-    context = {'users': users, 'query': query}
+        try:
+            users, next_cursor = search_page(request, query, request.GET.get('cursor'))
+        except InvalidCursor:
+            users, next_cursor = search_page(request, query, None)
+    
+    context = {'users': users, 'query': query, 'next_cursor': next_cursor}
     return render(request, 'core/search.html', context)
 
+@require_GET
+@login_required
+def typeahead_search(request):
+    prefix = request.GET.get('q', '').strip()
+    if not prefix:
+        return JsonResponse({'status': 'success', 'users': [], 'groups': []})
+
+    matches = typeahead.lookup(prefix)
+    return JsonResponse({
+        'status': 'success',
+        'users': [
+            {'id': user_id, 'username': username, 'url': reverse('profile', args=[username])}
+            for user_id, username in matches[USER]
+        ],
+        'groups': [
+            {'id': group_id, 'name': name, 'url': reverse('group_detail', args=[group_id])}
+            for group_id, name in matches[GROUP]
+        ],
+    })
+
+def serialize_search_hit(request, kind, obj):
+    if kind == 'comment':
+        url = reverse('post_detail', args=[obj.post_id])
+    elif kind == 'grouppost':
+        url = reverse('group_detail', args=[obj.group_id])
+    else:
+        url = reverse('post_detail', args=[obj.id])
+    return {
+        'type': kind,
+        'id': obj.id,
+        'content': obj.content,
+        'created_at': obj.created_at.isoformat(),
+        'url': url,
+        'user': {'id': obj.user.id, 'username': obj.user.username},
+    }
+
+@require_GET
+@login_required
+def content_search(request):
+    query = request.GET.get('q', '').strip()
+    kinds = request.GET.getlist('type') or list(SEARCHABLE_CONTENT)
+    if any(kind not in SEARCHABLE_CONTENT for kind in kinds):
+        return JsonResponse({'status': 'error', 'message': 'Unknown type'}, status=400)
+
+    hits = search_content(query, kinds) if query else []
+
+    # Group posts from private groups are only visible to members
+    group_post_ids = [object_id for kind, object_id in hits if kind == 'grouppost']
+    if group_post_ids:
+        hidden = set(
+            GroupPost.objects.filter(id__in=group_post_ids, group__privacy='private')
+            .exclude(group__members=request.user).values_list('id', flat=True)
+        )
+        hits = [(kind, object_id) for kind, object_id in hits if kind != 'grouppost' or object_id not in hidden]
+
+    try:
+        page, next_cursor = paginate_ids(hits, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    objects = {}
+    for kind in {kind for kind, _ in page}:
+        ids = [object_id for hit_kind, object_id in page if hit_kind == kind]
+        for obj in SEARCHABLE_CONTENT[kind].objects.select_related('user').filter(id__in=ids):
+            objects[(kind, obj.id)] = obj
+
+    return JsonResponse({
+        'status': 'success',
+        'results': [serialize_search_hit(request, hit[0], objects[hit]) for hit in page if hit in objects],
+        'next_cursor': next_cursor,
+    })
+
 # ======================
 # Password Reset Views
 # ======================
@@ -351,11 +493,14 @@ class CustomPasswordResetView(PasswordResetView):
 
 @login_required
 def groups(request):
-    # Fetch recommended groups (public groups the user hasn't joined)
-    recommended_groups = Group.objects.filter(privacy='public').exclude(members=request.user).order_by('?')[:4]
+    # Sample recommended groups from the user's precomputed pool
+    recommended_groups = sample_recommendations(request.user)
     
     # Fetch groups the user has joined
-    user_groups = Group.objects.filter(members=request.user)
+    user_groups = list(Group.objects.filter(members=request.user))
+    unread = unread_counts(request.user.id)
+    for group in user_groups:
+        group.unread_count = unread.get(group.id, 0)
 
     # Handle group creation
     if request.method == 'POST':
@@ -377,33 +522,16 @@ def groups(request):
         'form': form,
     }
     return render(request, 'core/groups.html', context)
-    recommended_groups = Group.objects.filter(privacy='public').exclude(members=request.user).order_by('?')[:4]
-    user_groups = request.user.joined_groups.all()
-    
-    if request.method == 'POST':
-        form = GroupForm(request.POST, request.FILES)
-        if form.is_valid():
-            group = form.save(commit=False)
-            group.creator = request.user
-            group.save()
-            group.members.add(request.user)
-            messages.success(request, 'Group created successfully!')
-            return redirect('group_detail', group_id=group.id)
-    else:
-        form = GroupForm()
-    
-    context = {
-        'recommended_groups': recommended_groups,
-        'user_groups': user_groups,
-        'form': form,
-    }
-    return render(request, 'core/groups.html', context)
 
 @login_required
 def group_detail(request, group_id):
     group = get_object_or_404(Group, id=group_id)
-    is_member = request.user in group.members.all()
-    posts = group.group_posts.all().order_by('-created_at')
+    is_member = is_group_member(group.id, request.user.id)
+    posts, next_cursor = paginate_request(
+        request,
+        annotate_liked(group.group_posts.select_related('user'), request.user)
+    )
+    like_buffer.overlay(posts)
     
     if not is_member and group.privacy == 'private':
         messages.warning(request, 'This is a private group. You need to be a member to view its content.')
@@ -414,7 +542,8 @@ def group_detail(request, group_id):
             group.members.add(request.user)
             return redirect('group_detail', group_id=group.id)
         if 'leave_group' in request.POST:
-            group.members.remove(request.user)
+            if is_member:
+                group.members.remove(request.user)
             return redirect('groups')
         
         post_form = GroupPostForm(request.POST, request.FILES)
@@ -431,6 +560,7 @@ def group_detail(request, group_id):
         'group': group,
         'is_member': is_member,
         'posts': posts,
+        'next_cursor': next_cursor,
         'post_form': post_form,
     }
     return render(request, 'core/group_detail.html', context)
@@ -443,19 +573,18 @@ def group_detail(request, group_id):
 def group_chat(request, group_id):
     group = get_object_or_404(Group, id=group_id)
     
-    if not group.members.filter(id=request.user.id).exists():
+    if not is_group_member(group.id, request.user.id):
         messages.warning(request, "You need to be a member to access this group chat")
         return redirect('group_detail', group_id=group.id)
     
-    messages = (GroupMessage.objects
-                .filter(group=group)
-                .select_related('sender')
-                .order_by('-timestamp')[:50])
+    # Newest messages from the in-memory history, newest first
+    history = [message_data(event, request.user.id) for event in recent_messages(group.id)]
+    if history:
+        mark_read(request.user.id, group.id, history[0]['id'])
     
     members = (group.members
                .annotate(online=Count('last_seen', 
-                      filter=Q(last_seen__gte=timezone.now()-timedelta(minutes=5))))
-               .select_related('profile'))
+                      filter=Q(last_seen__gte=timezone.now()-timedelta(minutes=5)))))
     
     active_calls = (group.calls
                     .filter(ended_at__isnull=True)
@@ -471,7 +600,8 @@ def group_chat(request, group_id):
 
     context = {
         'group': group,
-        'messages': messages,
+        'messages': history,
+        'history_cursor': history[-1]['id'] if len(history) == CHAT_HISTORY_PAGE_SIZE else None,
         'members': members,
         'active_calls': active_calls,
         'now': timezone.now(),
@@ -483,7 +613,7 @@ def group_chat(request, group_id):
 @login_required
 def send_group_message(request, group_id):
     group = get_object_or_404(Group, id=group_id)
-    if not group.members.filter(id=request.user.id).exists():
+    if not is_group_member(group.id, request.user.id):
         return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
     
     try:
@@ -493,22 +623,24 @@ def send_group_message(request, group_id):
         if not message_content:
             return JsonResponse({'status': 'error', 'message': 'Message cannot be empty'}, status=400)
         
-        message = GroupMessage.objects.create(
-            group=group,
-            sender=request.user,
-            content=message_content
+        message = chat_writer.new_message(group.id, request.user.id, message_content)
+        if not chat_writer.save(message):
+            return JsonResponse({'status': 'error', 'message': 'Message could not be sent'}, status=500)
+        # Wakes chat sockets and SSE streams subscribed to the group
+        async_to_sync(get_channel_layer().group_send)(
+            chat_group_name(group.id), record(group.id, message_event(message, request.user))
         )
         
         request.user.last_seen = timezone.now()
-        request.user.save()
+        request.user.save(update_fields=['last_seen'])
         
         response_data = {
             'status': 'success',
             'message': {
                 'id': message.id,
                 'content': message.content,
-                'sender': message.sender.username,
-                'sender_avatar': request.build_absolute_uri(message.sender.profile_picture.url) if message.sender.profile_picture else '',
+                'sender': request.user.username,
+                'sender_avatar': request.build_absolute_uri(request.user.profile_picture.url) if request.user.profile_picture else '',
                 'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
                 'is_self': True,
             }
@@ -538,10 +670,27 @@ def send_group_message(request, group_id):
     except json.JSONDecodeError:
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
+@login_required
+def group_chat_history(request, group_id):
+    if not is_group_member(group_id, request.user.id):
+        return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
+    
+    try:
+        before_id = int(request.GET.get('before', ''))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+    
+    history = [message_data(event, request.user.id) for event in older_messages(group_id, before_id)]
+    return JsonResponse({
+        'status': 'success',
+        'messages': history,
+        'next_cursor': history[-1]['id'] if len(history) == CHAT_HISTORY_PAGE_SIZE else None,
+    })
+
 @login_required
 def get_group_messages(request, group_id):
     group = get_object_or_404(Group, id=group_id)
-    if not group.members.filter(id=request.user.id).exists():
+    if not is_group_member(group.id, request.user.id):
         return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
     
     last_message_id = request.GET.get('last_id', 0)
@@ -557,7 +706,9 @@ def get_group_messages(request, group_id):
                 .order_by('timestamp'))
     
     messages_data = []
+    newest_id = None
     for message in messages:
+        newest_id = max(newest_id or 0, message.id)
         messages_data.append({
             'id': message.id,
             'content': message.content,
@@ -567,6 +718,8 @@ def get_group_messages(request, group_id):
             'is_self': message.sender == request.user,
         })
     
+    mark_read(request.user.id, group.id, newest_id)
+    
     online_members = list(group.members.filter(
         last_seen__gte=timezone.now()-timedelta(minutes=5))
         .values('id', 'username', 'profile_picture'))
@@ -782,20 +935,20 @@ def update_user_presence(request):
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=401)
 
+@require_POST
 @login_required
 def like_group_post(request, post_id):
     post = get_object_or_404(GroupPost, id=post_id)
     
-    if request.user in post.likes.all():
-        post.likes.remove(request.user)
-        liked = False
-    else:
-        post.likes.add(request.user)
-        liked = True
+    liked = like_buffer.toggle(post, request.user)
+    if liked:
+        trending.record('groups', post.group_id)
+    like_buffer.overlay([post])
     
     return JsonResponse({
+        'status': 'success',
         'liked': liked,
-        'count': post.likes.count()
+        'like_count': post.like_count,
     })
 
 class EmailTestView(View):
@@ -814,20 +967,112 @@ class EmailTestView(View):
         
 @login_required
 def for_you(request):
-    # Calculate the time 24 hours ago from now
-    one_day_ago = timezone.now() - timedelta(days=1)
-    
-    # Get all posts from all users created in the last 24 hours
-    posts = Post.objects.filter(
-        created_at__gte=one_day_ago
-    ).order_by('-created_at')
+    # Serve a slice of the viewer's cached, engagement-ranked post list
+    try:
+        posts, next_cursor = for_you_page(request, request.GET.get('cursor'))
+    except InvalidCursor:
+        posts, next_cursor = for_you_page(request, None)
     
     context = {
         'posts': posts,
+        'next_cursor': next_cursor,
         'now': timezone.now(),
     }
     return render(request, 'core/for_you.html', context)
 
+def for_you_page(request, cursor):
+    post_ids, next_cursor = paginate_for_you(request.user, cursor, get_page_size(request))
+    posts = annotate_liked(Post.objects.select_related('user'), request.user).in_bulk(post_ids)
+    posts = [posts[post_id] for post_id in post_ids if post_id in posts]
+    return like_buffer.overlay(posts), next_cursor
+
+# ======================
+# Feed API Views
+# ======================
+
+def serialize_post(post, fields=POST_FIELDS):
+    # The same post object the v1 stream emits, plus the viewer's like
+    return dict(export_object(post, fields), liked=post.liked)
+
+def feed_page_response(request, queryset, fields):
+    queryset = annotate_liked(queryset, request.user)
+    try:
+        posts, next_cursor = paginate(queryset, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+    like_buffer.overlay(posts)
+
+    return JsonResponse({
+        'status': 'success',
+        'posts': [serialize_post(post, fields) for post in posts],
+        'next_cursor': next_cursor,
+    })
+
+@require_GET
+@login_required
+def home_feed(request):
+    queryset = Post.objects.filter(id__in=get_timeline(request.user)).select_related('user')
+    return feed_page_response(request, queryset, POST_FIELDS)
+
+@require_GET
+@login_required
+def for_you_feed(request):
+    try:
+        posts, next_cursor = for_you_page(request, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'posts': [serialize_post(post) for post in posts],
+        'next_cursor': next_cursor,
+    })
+
+@require_GET
+@login_required
+def profile_feed(request, username):
+    user = get_object_or_404(User, username=username)
+    queryset = Post.objects.filter(user=user).select_related('user')
+    return feed_page_response(request, queryset, POST_FIELDS)
+
+@require_GET
+@login_required
+def group_feed(request, group_id):
+    group = get_object_or_404(Group, id=group_id)
+    if group.privacy == 'private' and not is_group_member(group.id, request.user.id):
+        return JsonResponse({'status': 'error', 'message': 'Not a member'}, status=403)
+
+    queryset = group.group_posts.select_related('user')
+    return feed_page_response(request, queryset, GROUP_POST_FIELDS)
+
+@require_GET
+@login_required
+def trending_now(request):
+    window = WINDOWS.get(request.GET.get('window', '1h'))
+    if window is None:
+        return JsonResponse({'status': 'error', 'message': 'Unknown window'}, status=400)
+    limit = get_page_size(request)
+
+    top_posts = trending.top('posts', limit, window)
+    top_groups = trending.top('groups', limit, window)
+    posts = annotate_liked(Post.objects.select_related('user'), request.user).in_bulk(
+        [post_id for post_id, _ in top_posts]
+    )
+    like_buffer.overlay(posts.values())
+    groups = Group.objects.filter(privacy='public').in_bulk([group_id for group_id, _ in top_groups])
+
+    return JsonResponse({
+        'status': 'success',
+        'posts': [
+            dict(serialize_post(posts[post_id]), score=score)
+            for post_id, score in top_posts if post_id in posts
+        ],
+        'groups': [
+            {'id': group_id, 'name': groups[group_id].name, 'score': score}
+            for group_id, score in top_groups if group_id in groups
+        ],
+    })
+
 
 def group_delete(request, group_id):
     group = get_object_or_404(Group, id=group_id)
@@ -130,13 +130,49 @@ SITE_ID = 1
 PASSWORD_RESET_TIMEOUT = 14400  # 4 hours (default)
 
 # Add at the bottom
-ASGI_APPLICATION = 'your_project.routing.application'
-
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+ASGI_APPLICATION = 'socialmedia.asgi.application'
+
+# With CHANNEL_BROKER_ADDRESS set (host:port or unix:/path), every ASGI
+# worker shares one channel layer served by `manage.py runchannelbroker`;
+# set it whenever more than one worker runs. Without it each process keeps
+# its own in-memory layer.
+if os.getenv('CHANNEL_BROKER_ADDRESS'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'core.channel_layer.BrokerChannelLayer',
+            'CONFIG': {
+                'address': os.getenv('CHANNEL_BROKER_ADDRESS'),
+                'token': os.getenv('CHANNEL_BROKER_TOKEN') or None,
+                'capacity': 100,
+                'expiry': 60,
+                'group_expiry': 86400,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Chat sequence numbers, the replay ring and chat history live in the cache,
+# so every worker needs to see the same one; set REDIS_URL in production.
+# Without it each process gets its own local-memory cache and those
+# features fall back to the database.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 26214400  # 25MB